@@ -1,5 +1,12 @@
 from board_recognition.includes import *
 import board_recognition.parameters as Params
+import pipeline.instrumentation as Instr
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# grid not found in the image (no Hough lines, not enough grid lines, all sweep candidates failed)
+class BoardDetectionError(Exception):
+    pass
 
 def sigmoid_contrast(img, cutoff=0.5, gain=10):
     img_normalized = img / 255.0
@@ -14,52 +21,210 @@ def cannyPF(img, sigma=0.25):
     upper = int(min(255, (1.0 + sigma) * med))
     return cv2.Canny(img, lower, upper)
 
+# corner points of the board grid: [top_left, top_right, bottom_left, bottom_right]
+# large photos are handled in pyramid mode: grid detected on a downscaled copy, corners refined at full resolution
 def process_board(orig_img):
+    if Params.pyramid_enabled and max(orig_img.shape[:2]) > Params.pyramid_detection_side:
+        corner_points = process_board_pyramid(orig_img)
+    else:
+        with Instr.stage("greyscale"):
+            #transform to greyscale
+            grey_img = cv2.cvtColor(orig_img, cv2.COLOR_RGB2GRAY)
+
+        corner_points = detect_board_corners(grey_img, default_detection_params())
+
+    return order_corner_points(corner_points)
+
+# parameters of a single grid detection (detect_corner_points)
+def default_detection_params():
+    return {
+        "bilat_sample_diameter": Params.bilat_sample_diameter,
+        "hough_min_points_line": Params.hough_min_points_line,
+        "line_clusters_eps": Params.line_clusters_eps,
+        "sorted_theta_threshold": Params.sorted_theta_threshold
+    }
+
+# pixel thresholds of the detection params for an image resolution_scale times the reference one
+def scale_detection_params(detection_params, resolution_scale):
+    return {
+        **detection_params,
+        "bilat_sample_diameter": max(3, int(round(detection_params["bilat_sample_diameter"] * resolution_scale))),
+        "hough_min_points_line": max(1, int(round(detection_params["hough_min_points_line"] * resolution_scale))),
+        "line_clusters_eps": detection_params["line_clusters_eps"] * resolution_scale
+    }
+
+# single detection with detection_params, or a parameter sweep around them (detection_sweep)
+# grid gate: grids with a score (grid_score) under grid_min_score are rejected with BoardDetectionError, before any warp/crop/model
+# with grid_gate_retry, a failed or weak single detection is first retried with the sweep variations
+# detection failures must raise BoardDetectionError (score_candidate, the retry below): any other exception aborts the detection
+def detect_board_corners(grey_img, detection_params):
+    retry = Params.grid_gate_enabled and Params.grid_gate_retry and not Params.detection_sweep
+
+    try:
+        if Params.detection_sweep:
+            corner_points, score = detect_corner_points_sweep(grey_img, sweep_candidates(detection_params))
+        else:
+            corner_points, score = detect_scored_corner_points(grey_img, detection_params)
+    except BoardDetectionError:
+        if not retry:
+            raise
+        corner_points, score = None, 0.0
+
+    if retry and score < Params.grid_min_score:
+        # grelha fraca -> tentar as variações da sweep (sem os parâmetros base, já tentados)
+        retry_candidates = [candidate for candidate in sweep_candidates(detection_params) if candidate != detection_params]
+        try:
+            with Instr.stage("grid_gate_retry"):
+                retry_corner_points, retry_score = detect_corner_points_sweep(grey_img, retry_candidates)
+            if retry_score > score:
+                corner_points, score = retry_corner_points, retry_score
+        except BoardDetectionError:
+            pass
+
+    if corner_points is None:
+        raise BoardDetectionError('>> No grid found')
+    if Params.grid_gate_enabled and score < Params.grid_min_score:
+        raise BoardDetectionError('>> Low grid confidence: score %.2f < %.2f' % (score, Params.grid_min_score))
+
+    return corner_points
+
+# detect grid on a copy downscaled to a long side of pyramid_detection_side, with the pixel thresholds scaled to that resolution,
+# then refine each corner with cornerSubPix in a small window of the full resolution image
+# detection cost is then the same for any photo size, only greyscale conversion and downscale grow with the megapixels
+def process_board_pyramid(orig_img):
+    with Instr.stage("greyscale"):
+        grey_img = cv2.cvtColor(orig_img, cv2.COLOR_RGB2GRAY)
+
+    with Instr.stage("pyramid"):
+        height, width = grey_img.shape[:2]
+        downscale = Params.pyramid_detection_side / max(height, width)
+        small_size = (max(1, int(round(width * downscale))), max(1, int(round(height * downscale))))
+        small_grey_img = cv2.resize(grey_img, small_size, interpolation=cv2.INTER_AREA) # area averaging, no aliasing of the grid lines
+
+    # thresholds were tuned for images with a long side of reference_image_side
+    resolution_scale = max(small_size) / Params.reference_image_side
+    small_corner_points = detect_board_corners(small_grey_img, scale_detection_params(default_detection_params(), resolution_scale))
+
+    # centro do píxel (x,y) da imagem reduzida corresponde a ((x+0.5)*escala - 0.5) na original
+    scale = np.array([width / small_size[0], height / small_size[1]], dtype=np.float32)
+    corner_points = ((small_corner_points + 0.5) * scale - 0.5).astype(np.float32)
+
+    with Instr.stage("corner_refinement"):
+        return refine_corner_points(grey_img, corner_points, float(scale.max()))
+
+# [top_left, top_right, bottom_left, bottom_right] in image coordinates
+# vertical lines can come out with theta on the other side of 0/pi (more often at the reduced resolution of the pyramid), the rho
+# order flips and the intersections come mirrored -> the first/last horizontal line pairs are kept, ordered top/bottom by y and each pair by x
+def order_corner_points(corner_points):
+    top_pair, bottom_pair = corner_points[:2], corner_points[2:]
+    if top_pair[:, 1].mean() > bottom_pair[:, 1].mean():
+        top_pair, bottom_pair = bottom_pair, top_pair
+
+    top_pair = top_pair[np.argsort(top_pair[:, 0], kind="stable")]
+    bottom_pair = bottom_pair[np.argsort(bottom_pair[:, 0], kind="stable")]
+    return np.concatenate([top_pair, bottom_pair]).astype(np.float32)
+
+# cornerSubPix around each corner, in a window of a few pixels of the detection level
+# corners too close to the image border, or that move more than the detection could be wrong by, keep the coarse position
+def refine_corner_points(grey_img, corner_points, detection_scale):
+    half_window = max(2, int(round(detection_scale * Params.pyramid_refine_window)))
+    max_shift = detection_scale * Params.pyramid_refine_max_shift
+    height, width = grey_img.shape[:2]
+
+    inside = ((corner_points[:, 0] >= half_window + 1) & (corner_points[:, 0] < width - half_window - 1) &
+              (corner_points[:, 1] >= half_window + 1) & (corner_points[:, 1] < height - half_window - 1))
+    if not inside.any():
+        return corner_points
+
+    refined_points = corner_points[inside].reshape(-1, 1, 2).copy()
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, Params.pyramid_refine_iterations, Params.pyramid_refine_epsilon)
+    cv2.cornerSubPix(grey_img, refined_points, (half_window, half_window), (-1, -1), criteria)
+    refined_points = refined_points.reshape(-1, 2)
+
+    accepted = np.linalg.norm(refined_points - corner_points[inside], axis=1) <= max_shift
+
+    result = corner_points.copy()
+    result[np.flatnonzero(inside)[accepted]] = refined_points[accepted]
+    return result
+
+# bilateral filter, canny, hough lines and line clustering over a greyscale image
+def detect_corner_points(grey_img, detection_params):
+    horiz_lines, vert_lines = detect_grid_lines(grey_img, detection_params)
+    return find_corner_points(horiz_lines, vert_lines)
+
+# (corner points, grid_score) of a single detection
+def detect_scored_corner_points(grey_img, detection_params):
+    horiz_lines, vert_lines = detect_grid_lines(grey_img, detection_params)
+    corner_points = find_corner_points(horiz_lines, vert_lines)
+
+    with Instr.stage("grid_score"):
+        return corner_points, grid_score(horiz_lines, vert_lines, corner_points, grey_img.shape)
+
+# horizontal and vertical lines of the grid (at most 9 each, sorted by rho)
+# cancel_event: set by another thread when the result is no longer needed -> stops between stages with BoardDetectionError
+def detect_grid_lines(grey_img, detection_params, cancel_event=None):
+    bilat_sample_diameter = detection_params["bilat_sample_diameter"]
+    hough_min_points_line = detection_params["hough_min_points_line"]
+    line_clusters_eps = detection_params["line_clusters_eps"]
 
-    #transform to greyscale
-    grey_img = cv2.cvtColor(orig_img, cv2.COLOR_RGB2GRAY)
+    with Instr.stage("bilateral_filter"):
+        # Apply Sigmoid contrast adjustment
+        # bilateral_filter_img = sigmoid_contrast(grey_img, cutoff=0.70, gain=7)
 
-    # Apply Sigmoid contrast adjustment
-    # bilateral_filter_img = sigmoid_contrast(grey_img, cutoff=0.70, gain=7)
+        #smooth noise, while keeping edges sharp -> por exemplo texturas de mesas de madeira desaparecem, facilita bastante
+        bilateral_filter_img = cv2.bilateralFilter(grey_img, bilat_sample_diameter, 75,75)
 
-    #smooth noise, while keeping edges sharp -> por exemplo texturas de mesas de madeira desaparecem, facilita bastante
-    bilateral_filter_img = cv2.bilateralFilter(grey_img, Params.bilat_sample_diameter, 75,75)
+    with Instr.stage("canny"):
+        #apply canny edge detection (para usar no proximo passo)
+        # explicação deste algoritmo: https://docs.opencv.org/4.x/da/d22/tutorial_py_canny.html#:~:text=Canny%20Edge%20Detection%20in%20OpenCV&text=Fourth%20argument%20is%20aperture_size.,By%20default%20it%20is%203.
+        canny_edge_filter_img = cannyPF(bilateral_filter_img, sigma=0.25)
 
-    #apply canny edge detection (para usar no proximo passo)
-    # explicação deste algoritmo: https://docs.opencv.org/4.x/da/d22/tutorial_py_canny.html#:~:text=Canny%20Edge%20Detection%20in%20OpenCV&text=Fourth%20argument%20is%20aperture_size.,By%20default%20it%20is%203.
-    canny_edge_filter_img = cannyPF(bilateral_filter_img, sigma=0.25)
+    check_cancelled(cancel_event)
 
-    cdst = cv2.cvtColor(canny_edge_filter_img, cv2.COLOR_GRAY2RGB)
+    # cdst = cv2.cvtColor(canny_edge_filter_img, cv2.COLOR_GRAY2RGB)
 
-    #apply Hough line Transform
-    # explicação deste algoritmo: https://docs.opencv.org/3.4/d9/db0/tutorial_hough_lines.html
-    # obter lista de (r,ang) de cada linha obtida
-    lines = cv2.HoughLines(
-                            canny_edge_filter_img, # input edge image
-                            1, # distance resolution in pixels
-                            np.pi/ Params.hough_angle_res,
-                            Params.hough_min_points_line,
-                            np.array([])
-                        )
+    with Instr.stage("hough"):
+        #apply Hough line Transform
+        # explicação deste algoritmo: https://docs.opencv.org/3.4/d9/db0/tutorial_hough_lines.html
+        # obter lista de (r,ang) de cada linha obtida
+        if Params.hough_two_pass:
+            lines = hough_lines_two_pass(canny_edge_filter_img, hough_min_points_line)
+        else:
+            lines = cv2.HoughLines(
+                                    canny_edge_filter_img, # input edge image
+                                    1, # distance resolution in pixels
+                                    np.pi/ Params.hough_angle_res,
+                                    hough_min_points_line,
+                                    np.array([])
+                                )
     
     if lines is None:
-        print('>> No lines detected in Hough Transform ?!')
-        exit(1)
-    lines = lines.squeeze() # remover lista a mais que vem de HoughLines
-    lines = fix_negative_rho_in_hesse_normal_form(lines) # meter todos os raios positivos, para contas certas
+        raise BoardDetectionError('>> No lines detected in Hough Transform ?!')
 
-    # k-means
-    horiz_lines, vert_lines, lines_center_angle = get_line_clusters_kmeans(lines, Params.kmeans_cluster_n)
+    check_cancelled(cancel_event)
 
-    old_horiz_lines = horiz_lines
+    with Instr.stage("clustering"):
+        lines = lines.reshape(-1, 2) # remover lista a mais que vem de HoughLines (squeeze daria shape (2,) com uma só linha)
+        if len(lines) < 2:
+            raise BoardDetectionError('>> Not enough lines to separate horizontal and vertical lines')
+        lines = fix_negative_rho_in_hesse_normal_form(lines) # meter todos os raios positivos, para contas certas
 
-    horiz_lines = simplify_line_clusters( horiz_lines, vert_lines) # obter linhas horizontais a partir de média de linhas verticais
-    vert_lines = simplify_line_clusters( vert_lines, old_horiz_lines) # obter linhas verticais a partir de média de linhas horizontais
+        # k-means
+        if Params.line_clustering_backend == "numpy":
+            horiz_lines, vert_lines, lines_center_angle = get_line_clusters_circular(lines)
+        else:
+            horiz_lines, vert_lines, lines_center_angle = get_line_clusters_kmeans(lines, Params.kmeans_cluster_n)
 
-    horiz_lines = find_best_lines_sorted(horiz_lines, theta_threshold=Params.sorted_theta_threshold)
-    vert_lines = find_best_lines_sorted(vert_lines, theta_threshold=0.1)
+        old_horiz_lines = horiz_lines
 
-    corner_points = find_corner_points(horiz_lines, vert_lines)
+        horiz_lines = simplify_line_clusters( horiz_lines, vert_lines, line_clusters_eps) # obter linhas horizontais a partir de média de linhas verticais
+        vert_lines = simplify_line_clusters( vert_lines, old_horiz_lines, line_clusters_eps) # obter linhas verticais a partir de média de linhas horizontais
+
+        horiz_lines = find_best_lines_sorted(horiz_lines, theta_threshold=detection_params["sorted_theta_threshold"])
+        vert_lines = find_best_lines_sorted(vert_lines, theta_threshold=detection_params["sorted_theta_threshold"])
+
+    if len(horiz_lines) < 2 or len(vert_lines) < 2:
+        raise BoardDetectionError('>> Not enough grid lines: %d horizontal, %d vertical' % (len(horiz_lines), len(vert_lines)))
 
     # cdst = print_lines(orig_img, horiz_lines, Params.color_green)
     # cdst = print_lines(cdst, vert_lines, Params.color_red)
@@ -69,7 +234,231 @@ def process_board(orig_img):
     # #print result
     # Prints.show_result(cdst)
     
-    return corner_points
+    return horiz_lines, vert_lines
+
+def check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise BoardDetectionError('>> Detection cancelled')
+
+# parameter sweep
+
+sweep_executor = None # shared by every sweep, created on first use
+sweep_executor_lock = threading.Lock()
+
+def get_sweep_executor():
+    global sweep_executor
+    with sweep_executor_lock:
+        if sweep_executor is None:
+            sweep_executor = ThreadPoolExecutor(max_workers=Params.sweep_workers, thread_name_prefix="detection_sweep")
+        return sweep_executor
+
+# detection_params with each sweep variation applied (factors of the base values), the base params first
+def sweep_candidates(detection_params):
+    candidates = []
+    for variation in Params.sweep_variations:
+        candidate = dict(detection_params)
+        for name, factor in variation.items():
+            candidate[name] = detection_params[name] * factor
+        candidate["bilat_sample_diameter"] = max(3, int(round(candidate["bilat_sample_diameter"])))
+        candidate["hough_min_points_line"] = max(1, int(round(candidate["hough_min_points_line"])))
+        candidates.append(candidate)
+    return candidates
+
+# runs every candidate (detection params, from sweep_candidates) concurrently (opencv releases the GIL), each grid gets a consistency score (grid_score)
+# result = first candidate, in sweep_variations order, with score >= sweep_accept_score -> deterministic, and as soon as it and
+# every candidate before it are done the others are cancelled (not started ones are dropped, running ones stop at the next stage)
+# if no candidate reaches sweep_accept_score, the best scored one
+# returns (corner points, grid score)
+def detect_corner_points_sweep(grey_img, candidates):
+    cancel_event = threading.Event()
+    results = [None] * len(candidates) # (score, corner_points), or None if the candidate failed
+
+    with Instr.stage("detection_sweep"):
+        executor = get_sweep_executor()
+        futures = {executor.submit(score_candidate, grey_img, candidate, cancel_event): i for i, candidate in enumerate(candidates)}
+        pending = set(futures)
+        accepted = None
+
+        try:
+            while pending and accepted is None:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[futures[future]] = future.result()
+
+                accepted = first_accepted_candidate(results, futures, pending)
+        finally:
+            cancel_event.set()
+            for future in pending:
+                future.cancel()
+
+    if accepted is None:
+        scored = [(result[0], -i) for i, result in enumerate(results) if result is not None]
+        if not scored:
+            raise BoardDetectionError('>> No grid found with any of the %d sweep parameter sets' % len(candidates))
+        accepted = -max(scored)[1] # melhor score, empates -> primeiro candidato
+
+    score, corner_points = results[accepted]
+    return corner_points, score
+
+# index of the first candidate with an accepted score, if every candidate before it is already done, else None
+def first_accepted_candidate(results, futures, pending):
+    pending_indexes = {futures[future] for future in pending}
+    for i, result in enumerate(results):
+        if i in pending_indexes:
+            return None
+        if result is not None and result[0] >= Params.sweep_accept_score:
+            return i
+    return None
+
+# (score, corner points) of a candidate, None if detection failed with it
+def score_candidate(grey_img, detection_params, cancel_event):
+    try:
+        horiz_lines, vert_lines = detect_grid_lines(grey_img, detection_params, cancel_event)
+        corner_points = find_corner_points(horiz_lines, vert_lines)
+    except BoardDetectionError:
+        return None
+    return grid_score(horiz_lines, vert_lines, corner_points, grey_img.shape), corner_points
+
+# consistency of a detected grid, in [0, 1]:
+#   9 lines in each direction
+#   regular spacing of each direction: perspective changes spacing gradually -> spacings close to a linear fit along the grid
+#   corners form a convex quadrilateral inside the image
+#   homography from the board to the corners is well conditioned (not a degenerate, almost flat quadrilateral)
+def grid_score(horiz_lines, vert_lines, corner_points, img_shape):
+    lines_score = min(len(horiz_lines), 9) / 9 * min(len(vert_lines), 9) / 9
+    spacing_score = spacing_regularity(horiz_lines, vert_lines) * spacing_regularity(vert_lines, horiz_lines)
+    conditioning_score = homography_conditioning(corner_points, img_shape)
+
+    height, width = img_shape[:2]
+    margin = Params.sweep_corners_margin * max(height, width)
+    inside_img = np.all((corner_points >= -margin) & (corner_points <= np.array([width, height]) + margin))
+    quadrilateral = corner_points[[0, 1, 3, 2]].astype(np.float32) # ordem do contorno: tl, tr, br, bl
+    convex = cv2.isContourConvex(quadrilateral) and cv2.contourArea(quadrilateral) > 0
+
+    return float(lines_score * spacing_score * conditioning_score) if inside_img and convex else 0.0
+
+# 1 for a homography (unit square -> corners, in image coordinates normalized by the long side) with condition number up to
+# grid_good_condition, down to 0 at grid_max_condition (log scale)
+def homography_conditioning(corner_points, img_shape):
+    normalized_corners = (corner_points / max(img_shape[:2])).astype(np.float32)
+    unit_square = np.array([[0, 0], [1, 0], [0, 1], [1, 1]], dtype=np.float32) # mesma ordem dos cantos: tl, tr, bl, br
+    homography = cv2.getPerspectiveTransform(unit_square, normalized_corners)
+    condition = np.linalg.cond(homography / homography[2, 2])
+    if not np.isfinite(condition):
+        return 0.0
+
+    log_good, log_max = np.log10(Params.grid_good_condition), np.log10(Params.grid_max_condition)
+    return float(np.clip((log_max - np.log10(condition)) / (log_max - log_good), 0.0, 1.0))
+
+# 1 for evenly (or linearly changing) spaced lines, down to 0 at sweep_max_spacing_error (rms error / mean spacing)
+def spacing_regularity(lines, perp_lines):
+    if len(lines) < 3:
+        return 0.0
+
+    perp_line_rho, perp_line_theta = np.mean(perp_lines, axis=0)
+    intersections = get_intersection_points(lines[:, 0], lines[:, 1], perp_line_rho, perp_line_theta)
+    positions = np.sort(intersections[:, 1] * np.cos(perp_line_theta) - intersections[:, 0] * np.sin(perp_line_theta)) # ao longo da reta perpendicular
+    spacings = np.diff(positions)
+    if not np.all(np.isfinite(spacings)) or spacings.mean() <= 0:
+        return 0.0
+
+    x = np.arange(len(spacings))
+    fit = np.polyval(np.polyfit(x, spacings, 1), x) if len(spacings) > 2 else spacings.mean()
+    spacing_error = np.sqrt(np.mean(np.square(spacings - fit))) / spacings.mean()
+    return float(max(0.0, 1 - spacing_error / Params.sweep_max_spacing_error))
+
+# two passes of the Hough transform:
+#   coarse pass (hough_coarse_angle_res bins over 0..pi) -> two dominant orientations of the grid, and the angle band of the lines of each one
+#   fine pass (hough_angle_res bins) only inside those bands, with min_theta/max_theta
+# band edges are aligned to the fine bins, so the accumulator cells are the same as a single full range pass
+# each band is voted with one extra bin on each side (except at 0 and pi, edges of the full accumulator too) and lines of those bins are dropped,
+# so local maxima inside the band are the same as in the full range pass, without fake maxima at the band edges
+# falls back to the single full range pass if the coarse pass doesn't find two orientations
+def hough_lines_two_pass(edges_img, min_votes):
+    fine_bins_n = int(Params.hough_angle_res)
+    fine_res = np.pi / fine_bins_n
+    bands = get_dominant_angle_bands(edges_img, min_votes)
+
+    if bands is None:
+        return cv2.HoughLines(edges_img, 1, fine_res, min_votes, np.array([]))
+
+    # opencv builds the sin/cos table accumulating the angle in float32 from min_theta -> start each band at the same float32 angle
+    # that the full range pass reaches in that bin, so the votes (and maxima) inside the bands are the same
+    bin_angles = np.concatenate(([0], np.cumsum(np.full(fine_bins_n, fine_res, dtype=np.float32), dtype=np.float32)))
+
+    band_lines = []
+    for start_bin, end_bin in bands:
+        voted_start, voted_end = max(start_bin - 1, 0), min(end_bin + 1, fine_bins_n)
+        min_theta = float(bin_angles[voted_start])
+        max_theta = min_theta + (voted_end - voted_start - 0.5) * fine_res # opencv votes floor((max-min)/res)+1 angles
+        lines = cv2.HoughLines(edges_img, 1, fine_res, min_votes, None, 0, 0, min_theta, max_theta)
+        if lines is None:
+            continue
+
+        line_bins = voted_start + np.round((lines[:, 0, 1] - np.float32(min_theta)) / fine_res)
+        lines[:, 0, 1] = line_bins * fine_res # same angle value as the full range pass
+        band_lines.append(lines[(line_bins >= start_bin) & (line_bins < end_bin)])
+
+    band_lines = [lines for lines in band_lines if len(lines) > 0]
+    return np.concatenate(band_lines) if band_lines else None
+
+# returns list of (start_bin, end_bin) of the fine accumulator (end excluded), inside [0, hough_angle_res], or None
+def get_dominant_angle_bands(edges_img, min_votes):
+    coarse_bins_n = int(Params.hough_coarse_angle_res)
+    fine_bins_n = int(Params.hough_angle_res)
+    fine_per_coarse = fine_bins_n // coarse_bins_n
+
+    # votos de cada linha do passo grosseiro pesam no histograma de orientações
+    coarse_lines = cv2.HoughLinesWithAccumulator(edges_img, Params.hough_coarse_rho_res, np.pi / coarse_bins_n, min_votes)
+    if coarse_lines is None:
+        return None
+    coarse_lines = coarse_lines.reshape(-1, 3)
+
+    # histograma circular de votos por ângulo (0 e pi são a mesma orientação)
+    line_bins = np.round(coarse_lines[:, 1] / (np.pi / coarse_bins_n)).astype(np.int64) % coarse_bins_n
+    histogram = np.bincount(line_bins, weights=coarse_lines[:, 2], minlength=coarse_bins_n)
+    smoothing = Params.hough_orientation_smoothing
+    histogram = np.convolve(np.concatenate((histogram[-smoothing:], histogram, histogram[:smoothing])), np.ones(2 * smoothing + 1), mode='valid')
+
+    bins = np.arange(coarse_bins_n)
+    circular_dist = lambda a, b: np.minimum(np.abs(a - b), coarse_bins_n - np.abs(a - b))
+
+    first_peak = int(np.argmax(histogram))
+    far_enough = circular_dist(bins, first_peak) >= Params.hough_min_orientation_separation
+    if not np.any(histogram[far_enough] > 0):
+        return None
+    second_peak = int(bins[far_enough][np.argmax(histogram[far_enough])])
+
+    # cada linha pertence à orientação mais próxima, banda = ângulos dessas linhas + margem
+    peaks = np.array([first_peak, second_peak])
+    nearest_peak = np.argmin(circular_dist(line_bins[:, None], peaks[None, :]), axis=1)
+
+    fine_ranges = []
+    for i, peak in enumerate(peaks):
+        offsets = (line_bins[nearest_peak == i] - peak + coarse_bins_n // 2) % coarse_bins_n - coarse_bins_n // 2 # signed circular offset to the peak
+        low = max(offsets.min(), -Params.hough_max_band_half_width) - Params.hough_band_margin
+        high = min(offsets.max(), Params.hough_max_band_half_width) + Params.hough_band_margin
+
+        start_bin, end_bin = (peak + low) * fine_per_coarse, (peak + high + 1) * fine_per_coarse
+        if end_bin - start_bin >= fine_bins_n:
+            return [(0, fine_bins_n)]
+
+        # bandas que passam por 0/pi são partidas em duas
+        start_bin, end_bin = start_bin % fine_bins_n, start_bin % fine_bins_n + (end_bin - start_bin)
+        if end_bin > fine_bins_n:
+            fine_ranges += [(start_bin, fine_bins_n), (0, end_bin - fine_bins_n)]
+        else:
+            fine_ranges.append((start_bin, end_bin))
+
+    # unir bandas sobrepostas, para não haver linhas repetidas
+    merged_ranges = []
+    for start_bin, end_bin in sorted(fine_ranges):
+        if merged_ranges and start_bin <= merged_ranges[-1][1]:
+            merged_ranges[-1] = (merged_ranges[-1][0], max(merged_ranges[-1][1], end_bin))
+        else:
+            merged_ranges.append((start_bin, end_bin))
+
+    return merged_ranges
 
 # obtain separated vertical and horizontal lines with kmeans
 # muito sucestível a extremos acho -> daí os maus resultados?
@@ -92,12 +481,67 @@ def get_line_clusters_kmeans(lines, clusters=2):
 
     return horiz_lines, vert_lines, (cluster_centers[horiz_label], cluster_centers[vert_label])
 
+# 2 clusters of the line orientations without sklearn, on the circle: theta and theta - pi (fix_negative_rho_in_hesse_normal_form)
+# are the same direction, so a straight 2-means on theta puts near-horizontal lines at +pi/2 and -pi/2 in different clusters
+#   orientations doubled -> points on the unit circle (theta mod pi)
+#   first center at the peak of a circular histogram, second at the bin with the most lines weighted by the distance to the first
+#   Lloyd iterations (nearest center, circular mean) until the labels stop changing
+# lines of each cluster are rewritten in the half turn around its center (theta -/+ pi with the sign of rho flipped), so the
+# means and medians of (rho, theta) of the next steps are taken over one representation of each direction
+def get_line_clusters_circular(lines):
+    angles = lines[:,1].astype(np.float64)
+    if len(angles) < 2:
+        raise BoardDetectionError('>> Not enough lines to separate horizontal and vertical lines')
+
+    doubled_angles = 2 * angles
+    points = np.stack((np.cos(doubled_angles), np.sin(doubled_angles)), axis=1)
+
+    bins = Params.line_angle_histogram_bins
+    histogram = np.bincount((np.mod(doubled_angles, 2 * np.pi) * bins / (2 * np.pi)).astype(np.int64) % bins, minlength=bins)
+    histogram = histogram + np.roll(histogram, 1) + np.roll(histogram, -1) # suavizar, histograma circular
+    bin_angles = (np.arange(bins) + 0.5) * 2 * np.pi / bins
+    first_center = bin_angles[np.argmax(histogram)]
+    second_center = bin_angles[np.argmax(histogram * (1 - np.cos(bin_angles - first_center)))]
+    cluster_centers = np.array([first_center, second_center])
+
+    cluster_labels = None
+    for _ in range(Params.line_angle_max_iterations):
+        new_labels = np.argmax(points @ np.stack((np.cos(cluster_centers), np.sin(cluster_centers))), axis=1) # centro mais próximo no círculo
+        if cluster_labels is not None and np.array_equal(new_labels, cluster_labels):
+            break
+        cluster_labels = new_labels
+        if np.bincount(cluster_labels, minlength=2).min() == 0:
+            raise BoardDetectionError('>> Not enough lines to separate horizontal and vertical lines')
+
+        cluster_centers = np.arctan2(np.bincount(cluster_labels, weights=points[:, 1], minlength=2),
+                                     np.bincount(cluster_labels, weights=points[:, 0], minlength=2)) # média circular
+
+    horiz_label = np.argmin(np.cos(cluster_centers)) # orientação mais perto de pi/2 (pi no círculo duplicado)
+    vert_label = 1 - horiz_label
+
+    horiz_lines, horiz_center = same_half_turn(lines[cluster_labels == horiz_label], cluster_centers[horiz_label] / 2)
+    vert_lines, vert_center = same_half_turn(lines[cluster_labels == vert_label], cluster_centers[vert_label] / 2)
+
+    return horiz_lines, vert_lines, (np.array([horiz_center]), np.array([vert_center]))
+
+# lines rewritten with theta within pi/2 of the center (theta -/+ pi and -rho describe the same line)
+# center taken as the representative (center + k*pi) that already holds the most lines, so those keep their (rho, theta)
+def same_half_turn(lines, center):
+    representatives = center + np.pi * np.arange(-2, 3)
+    center = representatives[np.argmax([np.count_nonzero(np.abs(lines[:, 1] - representative) < np.pi / 2) for representative in representatives])]
+
+    turns = np.round((lines[:, 1] - center) / np.pi)
+    lines = lines.copy()
+    lines[:, 1] = lines[:, 1] - turns * np.pi
+    lines[:, 0] = np.where(turns % 2 == 0, lines[:, 0], -lines[:, 0])
+    return lines, center
+
 def get_line_clusters_agglomerative(lines, clusters=2):
     angles = lines[:,1]
 
     #pré-computar distÂncias de ângulos entre cada 2 linhas, para usar em agglomerative clustering
-    angle_dist_func = lambda ang1, ang2 : min(abs(ang1 - ang2), 2 * np.pi - abs(ang1 - ang2)) # func de comparação de ângulos
-    dist_matrix = squareform(pdist(angles[:, np.newaxis], metric=angle_dist_func)) # angles[:, np.newaxis] -> separada cada ângulo em coluna diferente -> pdist calcula dists entre cada dois elems de diferentes colunas -> squareform transforma em matriz quadrâtica triangular
+    angle_diffs = np.abs(angles[:, np.newaxis] - angles[np.newaxis, :]) # diferença entre cada par de ângulos, por broadcasting
+    dist_matrix = np.minimum(angle_diffs, 2 * np.pi - angle_diffs) # distância circular
 
     #agglomerative clustering
     agglom = AgglomerativeClustering(n_clusters=clusters, metric='precomputed', linkage='average')
@@ -123,7 +567,7 @@ def fix_negative_rho_in_hesse_normal_form(lines: np.ndarray) -> np.ndarray:
 
 #obter pontos (x,y) de interseção de retas em formato polar, tirar retas desnecessárias
 # na prática só usado entre 
-def simplify_line_clusters(lines, perp_lines):
+def simplify_line_clusters(lines, perp_lines, eps=Params.line_clusters_eps):
 
     lines_rhos, lines_thetas = lines.T #transposta
 
@@ -131,19 +575,42 @@ def simplify_line_clusters(lines, perp_lines):
 
     horiz_intersections = get_intersection_points(lines_rhos, lines_thetas, perp_line_rho, perp_line_theta)
 
-    cluster = DBSCAN(eps=Params.line_clusters_eps, min_samples=Params.line_clusters_min_samples).fit(horiz_intersections)
-    labels = cluster.labels_
+    if Params.line_clustering_backend == "numpy" and Params.line_clusters_min_samples <= 1:
+        labels = group_collinear_points(horiz_intersections, perp_line_theta, eps)
+    else:
+        cluster = DBSCAN(eps=eps, min_samples=Params.line_clusters_min_samples).fit(horiz_intersections)
+        labels = cluster.labels_
 
-    final_lines = []
+    # mediana de (rho, theta) de cada cluster
+    return group_medians(lines, labels)
 
-    for label in np.unique(labels):
-        # criar boolean para label atual
-        mask = (labels == label)
-        # obter média para cada cluster
-        average_rho_theta = np.median(lines[mask], axis=0)
-        final_lines.append(average_rho_theta)
+# np.median(values[labels == label], axis=0) of every label (in np.unique order), without a loop over the labels
+def group_medians(values, labels):
+    _, labels = np.unique(labels, return_inverse=True) # labels 0..n-1, DBSCAN pode ter -1 (outliers)
+    counts = np.bincount(labels)
+    starts = np.cumsum(counts) - counts
+    low, high = starts + (counts - 1) // 2, starts + counts // 2 # elementos do meio de cada grupo (iguais se n ímpar)
 
-    return np.stack(final_lines)
+    medians = np.empty((len(counts), values.shape[1]), dtype=values.dtype)
+    for column in range(values.shape[1]):
+        sorted_values = values[np.lexsort((values[:, column], labels)), column] # ordenado por label, depois por valor
+        medians[:, column] = (sorted_values[low] + sorted_values[high]) / 2
+
+    return medians
+
+# same labels as DBSCAN(eps, min_samples=1) for points on the same line (intersections with one perpendicular line):
+# position of each point along the line -> sorted -> new cluster wherever the gap between consecutive points is bigger than eps
+# clusters are numbered by their first point, like DBSCAN
+def group_collinear_points(points, line_theta, eps):
+    positions = points[:, 1] * np.cos(line_theta) - points[:, 0] * np.sin(line_theta) # coordenada ao longo da reta (direção (-sin, cos))
+
+    order = np.argsort(positions, kind='stable')
+    sorted_groups = np.concatenate(([0], np.cumsum(np.diff(positions[order]) > eps)))
+    groups = np.empty(len(points), dtype=np.int64)
+    groups[order] = sorted_groups
+
+    _, first_index, labels = np.unique(groups, return_index=True, return_inverse=True)
+    return np.argsort(np.argsort(first_index))[labels]
 
 # obtain lines intersection points
 def get_intersection_points(rho1: np.ndarray, theta1: np.ndarray, rho2: np.ndarray, theta2: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
@@ -164,26 +631,18 @@ def find_best_lines_sorted(lines, theta_threshold=0.5, max_lines=9):
 
     #find largest sequence of consecutive thetas with (i) theta - (i-1)theta under the threshhold
     # nao podia so filtrar as linhas que n estivessem dentro do threshhold e na fase seguinte via as que tinham melhor espaçamento -> não porque a primeira linha podia logo ser a errada!!
-    max_subseq = []
-    current_subseq = [lines[0]]
-    
-    for i in range(1, len(lines)):
-        if abs(lines[i][1] - lines[i-1][1]) < theta_threshold:
-            current_subseq.append(lines[i])
-        else:
-            if len(current_subseq) > len(max_subseq):
-                max_subseq = current_subseq
-            current_subseq = [lines[i]]
-    
-    if len(current_subseq) > len(max_subseq):
-        max_subseq = current_subseq
+    # sequências começam onde a diferença para o theta anterior passa o threshold
+    run_starts = np.concatenate(([0], np.flatnonzero(np.abs(np.diff(lines[:, 1])) >= theta_threshold) + 1))
+    run_lengths = np.diff(np.append(run_starts, len(lines)))
+    longest_run = np.argmax(run_lengths) # primeira das maiores, como no ciclo original
 
-    largest_subsequence = np.array(max_subseq)
+    largest_subsequence = lines[run_starts[longest_run] : run_starts[longest_run] + run_lengths[longest_run]]
 
     # if largest subsequence >9 lines
     if len(largest_subsequence) > max_lines:
-        grid_lines = fit_linear_model_and_find_grid_lines(largest_subsequence, max_lines)
-        return grid_lines
+        if Params.grid_lines_engine == "lattice":
+            return find_grid_lines_lattice(largest_subsequence, max_lines)
+        return fit_linear_model_and_find_grid_lines(largest_subsequence, max_lines)
     else:
         return largest_subsequence
     
@@ -200,23 +659,20 @@ def fit_linear_model_and_find_grid_lines(lines, max_lines):
     max_deviations = np.maximum(np.abs(np.concatenate(([rho_diffs[0]], rho_diffs))),
                                 np.abs(np.concatenate((rho_diffs, [rho_diffs[-1]]))))
     
-    # Fit deviations to a linear model
-    X = np.arange(len(sorted_lines)).reshape(-1, 1)
-    model = LinearRegression()
-    model.fit(X, max_deviations)
+    # Fit deviations to a linear model (least squares on centered data, same operations as sklearn LinearRegression -> same values, same ties)
+    X = np.arange(len(sorted_lines), dtype=np.float64)
+    y = max_deviations.astype(np.float64)
+    slope = np.linalg.lstsq((X - X.mean())[:, np.newaxis], y - y.mean(), rcond=None)[0][0]
+    intercept = y.mean() - X.mean() * slope
     
     # Predict deviations using the linear model
-    deviations_pred = model.predict(X)
+    deviations_pred = X * slope + intercept
     
     # Calculate MSE for each line based on the deviation prediction
     mse = np.square(max_deviations - deviations_pred)
     
-    # Iteratively remove lines with highest MSE until max_lines is reached
-    indices_to_remove = []
-    while len(sorted_lines) - len(indices_to_remove) > max_lines:
-        max_mse_index = np.argmax(mse)
-        indices_to_remove.append(max_mse_index)
-        mse[max_mse_index] = -1  # Set to a low value to ignore in future iterations
+    # Remove the lines with highest MSE until max_lines is reached (empates -> menor índice primeiro)
+    indices_to_remove = np.argsort(-mse, kind='stable')[:len(sorted_lines) - max_lines]
     
     # Create a mask to filter out the lines to be removed
     mask = np.ones(len(sorted_lines), dtype=bool)
@@ -226,6 +682,46 @@ def fit_linear_model_and_find_grid_lines(lines, max_lines):
     remaining_lines = sorted_lines[mask]
     return remaining_lines
 
+# alternative to fit_linear_model_and_find_grid_lines: scores candidate lattices of max_lines lines directly
+# candidate = first line, last line and a spacing ratio between consecutive lines (perspective makes the spacing grow/shrink geometrically)
+#   expected rhos: first + (last - first) * (q^k - 1) / (q^(max_lines-1) - 1), k = 0..max_lines-1
+#   each expected rho takes its nearest line (searchsorted on the sorted rhos), error = distance / local spacing
+#   inliers = expected rhos with a line closer than lattice_inlier_tolerance of the local spacing
+# best candidate = most inliers, then lowest mean squared error of the inliers, without repeated lines
+# all candidates scored at once: arrays of (pairs, ratios, max_lines), no dimension for the lines
+def find_grid_lines_lattice(lines, max_lines):
+    sorted_lines = lines[lines[:, 0].argsort()]
+    rhos = sorted_lines[:, 0].astype(np.float64)
+    n = len(rhos)
+
+    first, last = np.triu_indices(n, k=max_lines - 1) # pares de retas com pelo menos max_lines-2 retas entre elas
+    ratios = np.linspace(1 - Params.lattice_max_spacing_change, 1 + Params.lattice_max_spacing_change, Params.lattice_ratio_steps)
+    ratios = ratios[np.abs(ratios - 1) > 1e-9]
+
+    k = np.arange(max_lines)
+    fractions = np.concatenate(((k / (max_lines - 1))[np.newaxis], (ratios[:, np.newaxis] ** k - 1) / (ratios[:, np.newaxis] ** (max_lines - 1) - 1))) # (ratios+1, max_lines), espaçamento constante incluído
+
+    spans = (rhos[last] - rhos[first])[:, np.newaxis, np.newaxis]
+    expected = rhos[first][:, np.newaxis, np.newaxis] + spans * fractions[np.newaxis] # (pares, ratios, max_lines)
+    spacings = np.diff(expected, axis=-1)
+    local_spacings = np.minimum(np.concatenate((spacings[..., :1], spacings), axis=-1), np.concatenate((spacings, spacings[..., -1:]), axis=-1))
+
+    # reta mais próxima de cada rho esperado: a anterior ou a seguinte na ordem dos rhos
+    following = np.clip(np.searchsorted(rhos, expected), 1, n - 1)
+    nearest = np.where(expected - rhos[following - 1] <= rhos[following] - expected, following - 1, following)
+    normalized_errors = np.abs(expected - rhos[nearest]) / local_spacings
+
+    inliers = normalized_errors < Params.lattice_inlier_tolerance
+    inliers_count = inliers.sum(axis=-1)
+    errors = np.where(inliers, np.square(normalized_errors), 0).sum(axis=-1) / np.maximum(inliers_count, 1)
+    inliers_count[np.any(np.diff(nearest, axis=-1) == 0, axis=-1)] = -1 # a mesma reta não pode ser duas linhas da grelha
+
+    best_pair, best_ratio = np.unravel_index(np.lexsort((errors.ravel(), -inliers_count.ravel()))[0], errors.shape)
+    if inliers_count[best_pair, best_ratio] < 0:
+        return fit_linear_model_and_find_grid_lines(lines, max_lines)
+
+    return sorted_lines[nearest[best_pair, best_ratio]]
+
 def find_corner_points(horiz_lines, vert_lines):
     filtered_horiz_lines = horiz_lines[[0,0,-1,-1]] # pegar so ém primeira e última linhas horiz
     filtered_vert_lines = vert_lines[[0,-1,0,-1]]
@@ -3,19 +3,22 @@ import numpy as np
 import math
 from pathlib import Path
 import random
-from sklearn.cluster import DBSCAN, KMeans, AgglomerativeClustering
-from sklearn.metrics import mean_squared_error
+from pipeline.lazy_imports import lazy_module, lazy_callable # sklearn/scipy só são importados no primeiro uso
+DBSCAN = lazy_callable("sklearn.cluster", "DBSCAN")
+KMeans = lazy_callable("sklearn.cluster", "KMeans")
+AgglomerativeClustering = lazy_callable("sklearn.cluster", "AgglomerativeClustering")
+mean_squared_error = lazy_callable("sklearn.metrics", "mean_squared_error")
 from itertools import combinations
-from scipy.spatial.distance import pdist, squareform
-from scipy.stats import mode
-from sklearn.preprocessing import PolynomialFeatures
-from sklearn.linear_model import LinearRegression
-from scipy.stats import iqr
+pdist = lazy_callable("scipy.spatial.distance", "pdist")
+squareform = lazy_callable("scipy.spatial.distance", "squareform")
+mode = lazy_callable("scipy.stats", "mode")
+PolynomialFeatures = lazy_callable("sklearn.preprocessing", "PolynomialFeatures")
+LinearRegression = lazy_callable("sklearn.linear_model", "LinearRegression")
+iqr = lazy_callable("scipy.stats", "iqr")
 import random
 import heapq
-from sklearn.linear_model import RANSACRegressor
+RANSACRegressor = lazy_callable("sklearn.linear_model", "RANSACRegressor")
 import time
-from models.squares_recognition import *
 import sys
 import typing
 import print_funcs.print_funcs as Prints
\ No newline at end of file
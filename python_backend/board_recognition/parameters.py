@@ -1,4 +1,37 @@
 
+#pyramid mode (large photos): grid detected on a downscaled copy, corners refined at full resolution
+pyramid_enabled = True
+pyramid_detection_side = 1200 # images with a larger long side are downscaled to it for the grid detection
+reference_image_side = 1200 # long side of the images (OSF dataset) the pixel thresholds below were tuned for, scaled to the detection resolution in pyramid mode
+pyramid_refine_window = 2 # half window of cornerSubPix, in pixels of the detection level
+pyramid_refine_max_shift = 1.5 # max movement of a refined corner, in pixels of the detection level
+pyramid_refine_iterations = 30
+pyramid_refine_epsilon = 0.01
+
+#parameter sweep: several detections with variations of the parameters below, run concurrently, best consistent grid kept
+detection_sweep = False
+sweep_workers = 4 # threads shared by every sweep
+sweep_variations = [ # factors applied to the base detection params, in order of preference (base params first)
+    {},
+    {"hough_min_points_line": 0.75},
+    {"hough_min_points_line": 1.3},
+    {"bilat_sample_diameter": 1.5},
+    {"line_clusters_eps": 1.5},
+    {"line_clusters_eps": 0.6},
+    {"sorted_theta_threshold": 2.0},
+    {"hough_min_points_line": 0.6, "bilat_sample_diameter": 1.5},
+]
+sweep_accept_score = 0.75 # grid score to accept a candidate without waiting for the others
+sweep_max_spacing_error = 0.25 # rms deviation of the grid line spacings from a linear fit, relative to the mean spacing, for a score of 0
+sweep_corners_margin = 0.05 # corners can be outside the image by this fraction of its long side
+
+#grid gate: weak grids are rejected before the warp, crops and models
+grid_gate_enabled = True
+grid_min_score = 0.2 # min grid_score (lines count, spacing regularity, convexity, homography conditioning) of an accepted grid
+grid_gate_retry = True # retry a failed or weak single detection with the sweep_variations
+grid_good_condition = 10 # condition number of the board homography (normalized coordinates) still fully trusted
+grid_max_condition = 1000 # condition number for a conditioning score of 0
+
 #bilateral filter
 bilat_sample_diameter = 7 # Diameter of each pixel neighborhood that is used during filtering
 
@@ -10,9 +43,21 @@ bilat_sample_diameter = 7 # Diameter of each pixel neighborhood that is used dur
 #hough_transform
 
 hough_angle_res = 720.0 # angle resolution in radians
+hough_two_pass = True # coarse pass finds the two grid orientations, fine pass only votes in angle bands around them
+hough_coarse_angle_res = 180 # bins of the coarse pass (hough_angle_res must be a multiple)
+hough_coarse_rho_res = 1 # pixels, distance resolution of the coarse pass
+hough_orientation_smoothing = 1 # coarse bins on each side summed when looking for the orientation peaks
+hough_min_orientation_separation = 20 # coarse bins between the two orientations
+hough_band_margin = 6 # coarse bins added on each side of the angles of the coarse lines of an orientation
+hough_max_band_half_width = 30 # coarse bins, max half width of a band around its orientation peak
 hough_min_points_line = 90 # min number of votes for valid line (min de pontos a intersetar nas sinuosoidais)
 # -> 80 works good
 
+#line clustering
+line_clustering_backend = "sklearn" # "sklearn" (KMeans + DBSCAN) or "numpy" (circular 2-means of the orientations + sorted gap grouping, no sklearn; not the same clusters as KMeans)
+line_angle_histogram_bins = 180 # bins of the circular histogram of the orientations that seeds the numpy 2-means
+line_angle_max_iterations = 20 # max Lloyd iterations of the numpy 2-means
+
 #kMeans
 kmeans_cluster_n = 2
 
@@ -23,3 +68,7 @@ line_clusters_min_samples = 1 # mínimo de samples para ponto não ser considera
 #find_best_lines 
 #Sorted
 sorted_theta_threshold = 0.1 # maximo de variação de ângulo de reta entre linhas consecutivas de grelha
+grid_lines_engine = "deviation" # "deviation" (remove lines with worst spacing deviation) or "lattice" (best scoring lattice of 9 lines)
+lattice_max_spacing_change = 0.15 # max change of spacing between consecutive grid lines (perspective), for the lattice engine
+lattice_ratio_steps = 31 # spacing ratios tested in [1 - change, 1 + change]
+lattice_inlier_tolerance = 0.2 # max distance of a line to its expected rho, as a fraction of the local spacing, to count as an inlier
@@ -1,30 +1,41 @@
 from numpy import save
 from draw_chessboard.includes import *
 import draw_chessboard.parameters as Params
+import pipeline.instrumentation as Instr
 
 square_size = int(Params.chessboard_size / 8)
 
-piece_images = {
-    1 : Image.open('draw_chessboard/pieces/dark_bishop.png').resize((square_size,square_size)),
-    2: Image.open('draw_chessboard/pieces/dark_king.png').resize((square_size,square_size)),
-    3: Image.open('draw_chessboard/pieces/dark_knight.png').resize((square_size,square_size)),
-    4: Image.open('draw_chessboard/pieces/dark_pawn.png').resize((square_size,square_size)),
-    5: Image.open('draw_chessboard/pieces/dark_queen.png').resize((square_size,square_size)),
-    6: Image.open('draw_chessboard/pieces/dark_rook.png').resize((square_size,square_size)),
-    7: Image.open('draw_chessboard/pieces/light_bishop.png').resize((square_size,square_size)),
-    8: Image.open('draw_chessboard/pieces/light_king.png').resize((square_size,square_size)),
-    9: Image.open('draw_chessboard/pieces/light_knight.png').resize((square_size,square_size)),
-    10: Image.open('draw_chessboard/pieces/light_pawn.png').resize((square_size,square_size)),
-    11: Image.open('draw_chessboard/pieces/light_queen.png').resize((square_size,square_size)),
-    12: Image.open('draw_chessboard/pieces/light_rook.png').resize((square_size,square_size)),
-    13: Image.open('draw_chessboard/pieces/unknown_occupation.png').resize((square_size,square_size)),
-    14: Image.open('draw_chessboard/pieces/unknown_piece.png').resize((square_size,square_size)),
+piece_files = {
+    1 : 'dark_bishop.png',
+    2: 'dark_king.png',
+    3: 'dark_knight.png',
+    4: 'dark_pawn.png',
+    5: 'dark_queen.png',
+    6: 'dark_rook.png',
+    7: 'light_bishop.png',
+    8: 'light_king.png',
+    9: 'light_knight.png',
+    10: 'light_pawn.png',
+    11: 'light_queen.png',
+    12: 'light_rook.png',
+    13: 'unknown_occupation.png',
+    14: 'unknown_piece.png',
 }
 
+piece_images = {} # sprites só são abertos/redimensionados no primeiro desenho em que aparecem
+
+def get_piece_image(piece: int) -> Image:
+    img = piece_images.get(piece)
+    if img is None:
+        img = Image.open(f'draw_chessboard/pieces/{piece_files[piece]}').resize((square_size,square_size))
+        piece_images[piece] = img
+    return img
+
 def draw_chessboard(piece_positions: np.ndarray, square_size = square_size, save_path=""):
     try:  
-        grid = draw_grid(square_size)
-        chessboard = paste_pieces(grid, piece_positions)
+        with Instr.stage("rendering"):
+            grid = draw_grid(square_size)
+            chessboard = paste_pieces(grid, piece_positions)
 
         chessboard.show(title="Result")
 
@@ -48,6 +59,7 @@ def paste_pieces(chessboard: Image,  piece_positions: np.ndarray) -> Image:
     for i, piece in enumerate(piece_positions):
         if piece != 0:
             (row, col) = divmod(i,8)
-            chessboard.paste(piece_images[piece], (col * square_size, row * square_size, (col + 1) * square_size, (row + 1) * square_size), piece_images[piece])
+            piece_img = get_piece_image(piece)
+            chessboard.paste(piece_img, (col * square_size, row * square_size, (col + 1) * square_size, (row + 1) * square_size), piece_img)
     
     return chessboard
\ No newline at end of file
@@ -3,5 +3,6 @@ import numpy as np
 import numpy.typing
 import math
 from pathlib import Path
-import matplotlib.pyplot as plt
+from pipeline.lazy_imports import lazy_module
+plt = lazy_module("matplotlib.pyplot") # matplotlib só é importado no primeiro uso
 import traceback
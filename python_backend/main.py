@@ -4,11 +4,20 @@ import board_recognition.board_recognition as BoardRecogn
 import board_recognition.parameters as BoardRecognParams
 import models.squares_recognition as ModelsSquares
 import models.pieces_recognition as ModelsPieces
-import process_datasets.pieces_datasets as ProcPiecesData
-import process_datasets.squares_datasets as ProcSquaresData
-import process_datasets.chessred_dataset as ProcChRed
-import process_datasets.osf_dataset as ProcOsf
+import models.models_common as ModelsCommon
+import models.models_export as ModelsExport
+import pipeline.batch_recognition as BatchRecogn
+import pipeline.server as Server
+import pipeline.stream_recognition as StreamRecogn
+import pipeline.recognition as Recogn
+import pipeline.instrumentation as Instr
+import pipeline.startup_benchmark as StartupBench
+import pipeline.benchmark as Benchmark
+import pipeline.corners_harness as CornersHarness
+from pipeline.lazy_imports import lazy_module
 import print_funcs.print_funcs as Prints
+ProcChRed = lazy_module("process_datasets.chessred_dataset") # dataset building, not needed for inference
+ProcOsf = lazy_module("process_datasets.osf_dataset")
 import draw_chessboard.draw_funcs as DrawBoard
 import sys
 import cv2
@@ -16,25 +25,66 @@ import time
 
 def get_img():
     photo_path = sys.argv[1]
-    orig_img = cv2.imread(photo_path, cv2.IMREAD_COLOR)
-
-    if orig_img is None:
-        raise Exception('Error opening image:', photo_path)
-
-    return orig_img
+    return Recogn.read_board_img(photo_path)
 
 def main():
     try:
+        if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+            BatchRecogn.main_batch(sys.argv[2:])
+            return
+
+        if len(sys.argv) > 1 and sys.argv[1] == "--stream":
+            StreamRecogn.main_stream(sys.argv[2:])
+            return
+
+        if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+            Server.main_server(sys.argv[2:])
+            return
+
+        if len(sys.argv) > 1 and sys.argv[1] == "--serve-bench":
+            Server.main_load_test(sys.argv[2:])
+            return
+
+        if len(sys.argv) > 1 and sys.argv[1] == "--export":
+            ModelsExport.main_export(sys.argv[2:])
+            return
+
+        if len(sys.argv) > 1 and sys.argv[1] == "--migrate-uint8":
+            ModelsExport.main_migrate_uint8(sys.argv[2:])
+            return
+
+        if len(sys.argv) > 1 and sys.argv[1] == "--compare-predict":
+            ModelsExport.main_compare_predict(sys.argv[2:])
+            return
+
+        if len(sys.argv) > 1 and sys.argv[1] == "--compare-backends":
+            ModelsExport.main_compare_backends(sys.argv[2:])
+            return
+
+        if len(sys.argv) > 1 and sys.argv[1] == "--benchmark":
+            Benchmark.main_benchmark(sys.argv[2:])
+            return
+
+        if len(sys.argv) > 1 and sys.argv[1] == "--corners-bench":
+            CornersHarness.main_corners_harness(sys.argv[2:])
+            return
+
+        if len(sys.argv) > 1 and sys.argv[1] == "--startup-bench":
+            StartupBench.main_startup_bench(sys.argv[2:])
+            return
+
         if len(sys.argv) != 2:
             raise Exception("main.py <input_photo_path> <output_folder_path>")
         
+        Instr.enable_from_params()
+
         orig_img = get_img()
 
-        start_time = time.time()
+        ModelsCommon.preload_models() # load models before timing, so measured time is only recognition
 
-        corner_points = BoardRecogn.process_board(orig_img)
+        start_time = time.time()
 
-        square_imgs = ProcSquaresData.process_squares_img(orig_img, corner_points)
+        corner_points, warped_board, square_imgs = Recogn.process_board_squares(orig_img) # same warped board is used for pieces crops
 
         # Prints.show_squares_grid(square_imgs)
 
@@ -43,7 +93,7 @@ def main():
         # Prints.print_array_in_chess_format(square_predicts)
         print("Execution time: %s s" % (time.time() - start_time)) # print do tempo decorrido
         
-        piece_imgs, occupation_mask = ProcPiecesData.process_pieces_img(orig_img,corner_points, square_predicts)
+        piece_imgs, occupation_mask = Recogn.process_board_pieces(orig_img, corner_points, square_predicts, warped_board)
         piece_predicts, uncertain_piece_predicts = ModelsPieces.interpret_pieces(piece_imgs, occupation_mask)
 
         print("Execution time: %s s" % (time.time() - start_time)) # print do tempo decorrido
@@ -62,6 +112,9 @@ def main():
         #draw resulting chessboard
         DrawBoard.draw_chessboard(piece_predicts)
 
+        if Instr.is_enabled():
+            Instr.print_summary()
+
     except Exception as e:
         print(e)
     
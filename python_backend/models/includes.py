@@ -3,11 +3,28 @@ import random
 import numpy as np
 import sys
 from pathlib import Path
-import matplotlib.pyplot as plt
+from pipeline.lazy_imports import lazy_module, lazy_callable # tensorflow/keras/matplotlib só são importados no primeiro uso
+plt = lazy_module("matplotlib.pyplot")
 import traceback
 
-import tensorflow as tf
-from keras.models import Sequential
-from keras.layers import Dense, Conv2D, MaxPooling2D, Dropout, Flatten, Input
-from keras.optimizers import Adam
-from keras.saving import load_model
+tf = lazy_module("tensorflow")
+Sequential = lazy_callable("keras.models", "Sequential")
+Dense = lazy_callable("keras.layers", "Dense")
+Conv2D = lazy_callable("keras.layers", "Conv2D")
+MaxPooling2D = lazy_callable("keras.layers", "MaxPooling2D")
+Dropout = lazy_callable("keras.layers", "Dropout")
+Flatten = lazy_callable("keras.layers", "Flatten")
+Input = lazy_callable("keras.layers", "Input")
+Rescaling = lazy_callable("keras.layers", "Rescaling")
+Model = lazy_callable("keras.models", "Model")
+Adam = lazy_callable("keras.optimizers", "Adam")
+load_model = lazy_callable("keras.saving", "load_model")
+
+import threading
+from collections import OrderedDict
+import functools
+import os
+import tempfile
+import time
+import math
+from bisect import bisect_left
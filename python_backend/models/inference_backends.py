@@ -0,0 +1,81 @@
+from models.includes import *
+import models.parameters as Params
+
+"""
+    Lightweight runtimes for models exported by models_export, alternatives to keras model.predict
+    each loader returns a predict function: batch of uint8 images -> probabilities of each class
+    models exported from models with uint8 inputs (see models_common.with_uint8_input) receive the images as they are,
+    older ones with float inputs receive them normalized on the host
+"""
+
+backend_suffixes = {"tflite": ".tflite", "onnx": ".onnx"}
+
+# exported models are saved next to the original .keras file, with the backend suffix
+def exported_model_path(model_path, backend):
+    return str(Path(model_path).with_suffix(backend_suffixes[backend]))
+
+def load_tflite_predictor(model_path):
+    try:
+        from tflite_runtime.interpreter import Interpreter # standalone runtime, if installed
+    except ImportError:
+        Interpreter = tf.lite.Interpreter
+
+    interpreter = Interpreter(model_path=model_path, num_threads=os.cpu_count())
+    input_details = interpreter.get_input_details()[0]
+    output_details = interpreter.get_output_details()[0]
+
+    uint8_input = input_details["dtype"] == np.uint8
+    interpreter_lock = threading.Lock() # interpreter can't run in several threads at the same time
+    allocated_shape = [None] # input shape tensors are currently allocated for
+
+    def predict(imgs):
+        with interpreter_lock:
+            if allocated_shape[0] != imgs.shape:
+                interpreter.resize_tensor_input(input_details["index"], imgs.shape)
+                interpreter.allocate_tensors()
+                allocated_shape[0] = imgs.shape
+
+            interpreter.set_tensor(input_details["index"], imgs if uint8_input else quantize_tensor(normalize_imgs(imgs), input_details))
+            interpreter.invoke()
+            return dequantize_tensor(interpreter.get_tensor(output_details["index"]), output_details)
+
+    return predict
+
+def load_onnx_predictor(model_path):
+    import onnxruntime # optional dependency, only needed for this backend
+
+    session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+    model_input = session.get_inputs()[0]
+    uint8_input = model_input.type == "tensor(uint8)"
+
+    def predict(imgs):
+        return session.run(None, {model_input.name: imgs if uint8_input else normalize_imgs(imgs)})[0]
+
+    return predict
+
+predictor_loaders = {"tflite": load_tflite_predictor, "onnx": load_onnx_predictor}
+
+#aux funcs
+
+# host normalization of uint8 images, for models with float inputs
+def normalize_imgs(imgs):
+    imgs = imgs.astype(np.float32) # convert to float to avoid overflows
+    imgs /= 255.0
+    return imgs
+
+# int8 quantized models expect quantized inputs, float ones receive them unchanged
+def quantize_tensor(values, tensor_details):
+    dtype = tensor_details["dtype"]
+    if not np.issubdtype(dtype, np.integer):
+        return values.astype(dtype, copy=False)
+
+    scale, zero_point = tensor_details["quantization"]
+    dtype_info = np.iinfo(dtype)
+    return np.clip(np.round(values / scale + zero_point), dtype_info.min, dtype_info.max).astype(dtype)
+
+def dequantize_tensor(values, tensor_details):
+    if not np.issubdtype(tensor_details["dtype"], np.integer):
+        return values
+
+    scale, zero_point = tensor_details["quantization"]
+    return (values.astype(np.float32) - zero_point) * scale
@@ -2,15 +2,156 @@ from numpy import square
 from models.includes import *
 import models.parameters as Params
 import board_recognition.parameters as BoardParams
+import models.inference_backends as Backends
 
 
-def import_CNN(input_path):
+# process-wide registry of loaded models, so each model file is only deserialized once
+_loaded_models = OrderedDict() # model path -> {"loaded": model, "attached": {name: object built from the model}}, from least to most recently used
+_loaded_models_lock = threading.RLock()
+
+def import_CNN(input_path, compile=True):
     model = load_model(
                 input_path,
-                compile=True)
+                compile=compile)
     
     return model
 
+# obtain model from the registry, loading it (without compiling, only used for inference) if not loaded yet
+def get_model(model_path):
+    model_path = str(model_path)
+    return get_loaded(model_path, functools.partial(import_inference_CNN, model_path))
+
+def import_inference_CNN(input_path):
+    model = import_CNN(input_path, compile=False)
+    return with_uint8_input(model) if Params.uint8_model_inputs else model
+
+# models trained with images normalized to [0, 1] -> same model receiving the uint8 images, normalized by a Rescaling layer inside the graph
+def with_uint8_input(model):
+    if has_uint8_input(model):
+        return model
+
+    inputs = Input(shape=model.input_shape[1:], dtype="uint8")
+    outputs = model(Rescaling(1./255)(inputs))
+    return Model(inputs, outputs, name=model.name + "_uint8")
+
+def has_uint8_input(model):
+    return model.inputs[0].dtype == "uint8"
+
+# obtain loaded object from the registry, calling load_func if not loaded yet
+# least recently used objects are evicted when more than Params.max_loaded_models are in memory
+def get_loaded(key, load_func):
+    with _loaded_models_lock:
+        return get_loaded_entry(key, load_func)["loaded"]
+
+# object built from a loaded one (ex: compiled predictor of a model), kept in the same registry entry:
+# it doesn't take a slot of Params.max_loaded_models, and is evicted together with the object it references
+def get_attached(key, load_func, name, attach_func):
+    with _loaded_models_lock:
+        entry = get_loaded_entry(key, load_func)
+        if name not in entry["attached"]:
+            entry["attached"][name] = attach_func(entry["loaded"])
+        return entry["attached"][name]
+
+def get_loaded_entry(key, load_func):
+    entry = _loaded_models.get(key)
+
+    if entry is None:
+        entry = {"loaded": load_func(), "attached": {}}
+        _loaded_models[key] = entry
+
+        while len(_loaded_models) > Params.max_loaded_models:
+            _loaded_models.popitem(last=False) # evict least recently used
+    else:
+        _loaded_models.move_to_end(key) # mark as most recently used
+
+    return entry
+
+# eagerly load models at startup, so the first recognition doesn't pay for it
+def preload_models(model_paths=None):
+    if model_paths is None:
+        model_paths = [Params.best_squares_model_path, Params.best_pieces_model_path]
+
+    for model_path in model_paths:
+        if Params.inference_backend == "keras" and not Params.keras_compiled_predict:
+            get_model(model_path)
+        elif Params.inference_backend == "keras":
+            get_compiled_predictor(model_path) # also traces and warms up the compiled function
+        else:
+            get_predictor(model_path)
+
+def unload_models():
+    with _loaded_models_lock:
+        _loaded_models.clear()
+
+# function that receives a batch of uint8 images and returns the predicted probabilities of each class
+# runs the .keras model, or the model exported next to it for the given backend (default Params.inference_backend)
+def get_predictor(model_path, backend=None):
+    backend = backend or Params.inference_backend
+
+    if backend == "keras":
+        return functools.partial(predict_keras, str(model_path))
+
+    exported_path = Backends.exported_model_path(model_path, backend)
+    return get_loaded(exported_path, functools.partial(Backends.predictor_loaders[backend], exported_path))
+
+def predict_keras(model_path, imgs):
+    if Params.keras_compiled_predict:
+        return get_compiled_predictor(model_path)(imgs)
+
+    return predict_keras_model(model_path, imgs)
+
+# keras model.predict, made for large datasets (per call setup, callbacks, python loop over batches)
+def predict_keras_model(model_path, imgs):
+    model = get_model(model_path)
+    if not has_uint8_input(model):
+        imgs = Backends.normalize_imgs(imgs)
+
+    return model.predict(
+            imgs,
+            batch_size = Params.batch_size,
+            verbose=2)
+
+# model call compiled in a tf.function, a single graph execution for each batch (up to the largest bucket)
+# kept on the registry entry of the model (see get_attached)
+def get_compiled_predictor(model_path):
+    model_path = str(model_path)
+    return get_attached(model_path, functools.partial(import_inference_CNN, model_path), "compiled", load_compiled_predictor)
+
+# input signature with any batch size, traced once
+# with jit_compile (XLA) each batch shape is compiled on its own -> batches padded to the next size of Params.compiled_batch_buckets
+# warm up on load with the sizes of Params.compiled_warmup_batches, so the first predictions don't pay for tracing/compiling
+def load_compiled_predictor(model):
+    uint8_input = has_uint8_input(model)
+    input_shape = tuple(model.input_shape[1:])
+    jit_compile = Params.compiled_jit_compile
+    max_batch = Params.compiled_batch_buckets[-1]
+
+    @tf.function(input_signature=[tf.TensorSpec((None,) + input_shape, tf.uint8 if uint8_input else tf.float32)], jit_compile=jit_compile)
+    def call_model(imgs):
+        return model(imgs, training=False)
+
+    def predict(imgs):
+        if not uint8_input:
+            imgs = Backends.normalize_imgs(imgs)
+
+        outputs = []
+        for i in range(0, len(imgs), max_batch):
+            batch = imgs[i : i + max_batch]
+            batch_size = len(batch)
+            if jit_compile:
+                bucket_size = Params.compiled_batch_buckets[bisect_left(Params.compiled_batch_buckets, batch_size)]
+                # padding with the shape of the batch itself, the model input can have free (None) dimensions
+                batch = np.concatenate([batch, np.zeros((bucket_size - batch_size,) + batch.shape[1:], dtype=batch.dtype)])
+            outputs.append(np.asarray(call_model(batch))[:batch_size])
+
+        return np.concatenate(outputs) if len(outputs) != 1 else outputs[0]
+
+    if None not in input_shape: # inputs of any size (fully convolutional models) are traced on the first prediction
+        for batch_size in Params.compiled_warmup_batches:
+            predict(np.zeros((batch_size,) + input_shape, dtype=np.uint8))
+
+    return predict
+
 def train_vanilla_CNN(input_dataset_folder, output_folder, model, model_name, epochs=3):
     try:
         input_image_size = model.input_shape[1:3]
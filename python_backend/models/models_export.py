@@ -0,0 +1,216 @@
+from models.includes import *
+import models.parameters as Params
+import models.models_common as Common
+import models.inference_backends as Backends
+
+"""
+    Export of keras models to TFLite/ONNX, to be run with the lightweight runtimes of inference_backends
+    and migration of .keras models to uint8 inputs (normalization inside the graph)
+"""
+
+# python3 main.py --export <model_path> <tflite|onnx> [float16|int8] [calibration_dataset_folder]
+def main_export(args):
+    if len(args) < 2:
+        raise Exception("main.py --export <model_path> <tflite|onnx> [float16|int8] [calibration_dataset_folder]")
+
+    model_path, backend = args[0], args[1]
+    quantization = args[2] if len(args) > 2 else None
+    calibration_folder = args[3] if len(args) > 3 else None
+
+    export_model(model_path, backend, quantization, calibration_folder)
+
+# python3 main.py --migrate-uint8 <model_path> [output_model_path]
+# the migrated model can then be exported, so the tflite/onnx backends also receive uint8 images
+def main_migrate_uint8(args):
+    if len(args) not in (1, 2):
+        raise Exception("main.py --migrate-uint8 <model_path> [output_model_path]")
+
+    migrate_uint8_model(*args)
+
+# python3 main.py --compare-backends <model_path> <tflite|onnx> <test_dataset_folder>
+def main_compare_backends(args):
+    if len(args) != 3:
+        raise Exception("main.py --compare-backends <model_path> <tflite|onnx> <test_dataset_folder>")
+
+    compare_backends(*args)
+
+# quantization: None, "float16" (tflite only) or "int8" (needs calibration_folder, with a subfolder of images per class)
+def export_model(model_path, backend, quantization=None, calibration_folder=None):
+    if backend not in Backends.backend_suffixes:
+        raise Exception("Unknown backend: " + backend)
+    if quantization == "int8" and calibration_folder is None:
+        raise Exception("int8 quantization needs a calibration dataset folder")
+
+    model = Common.import_CNN(model_path, compile=False)
+    model(np.zeros((1,) + model.input_shape[1:], dtype=model.inputs[0].dtype)) # exporters need the model to have been called once
+    output_path = Backends.exported_model_path(model_path, backend)
+
+    calibration_imgs = None
+    if calibration_folder is not None:
+        calibration_imgs, _ = load_dataset_sample(calibration_folder, model.input_shape[1:3], Params.calibration_samples)
+        if not Common.has_uint8_input(model):
+            calibration_imgs = Backends.normalize_imgs(calibration_imgs)
+
+    if backend == "tflite":
+        export_tflite(model, output_path, quantization, calibration_imgs)
+    else:
+        export_onnx(model, output_path, quantization, calibration_imgs)
+
+    print("Exported model to", output_path)
+    return output_path
+
+# .keras model with float inputs -> same model with uint8 inputs and a Rescaling layer (see Common.with_uint8_input)
+# saved next to the original as <name>_uint8.keras by default
+def migrate_uint8_model(model_path, output_path=None):
+    model = Common.import_CNN(model_path, compile=False)
+    if Common.has_uint8_input(model):
+        raise Exception("Model already has uint8 inputs: " + str(model_path))
+
+    if output_path is None:
+        output_path = Path(model_path).with_name(Path(model_path).stem + "_uint8.keras")
+
+    Common.with_uint8_input(model).save(output_path)
+    print("Migrated model saved to", output_path)
+    return output_path
+
+def export_tflite(model, output_path, quantization=None, calibration_imgs=None):
+    with tempfile.TemporaryDirectory() as saved_model_dir:
+        model.export(saved_model_dir, format="tf_saved_model")
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+
+        if quantization == "float16":
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_types = [tf.float16]
+
+        elif quantization == "int8": # full integer quantization, ranges of activations calibrated with dataset images
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.representative_dataset = lambda: ([img[np.newaxis]] for img in calibration_imgs)
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            if not Common.has_uint8_input(model): # uint8 inputs are kept, and quantized inside the graph
+                converter.inference_input_type = tf.int8
+            converter.inference_output_type = tf.int8
+
+        elif quantization is not None:
+            raise Exception("Unknown quantization: " + quantization)
+
+        Path(output_path).write_bytes(converter.convert())
+
+def export_onnx(model, output_path, quantization=None, calibration_imgs=None):
+    if quantization not in (None, "int8"):
+        raise Exception("Quantization not supported for onnx: " + quantization)
+
+    if quantization is None:
+        model.export(output_path, format="onnx")
+        return
+
+    from onnxruntime.quantization import quantize_static, CalibrationDataReader, QuantFormat, QuantType # optional dependency
+
+    # static quantization, ranges of activations calibrated with dataset images
+    class DatasetCalibrationReader(CalibrationDataReader):
+        def __init__(self, input_name):
+            self.imgs = iter(calibration_imgs)
+            self.input_name = input_name
+
+        def get_next(self):
+            img = next(self.imgs, None)
+            return None if img is None else {self.input_name: img[np.newaxis]}
+
+    with tempfile.TemporaryDirectory() as float_model_dir:
+        float_model_path = str(Path(float_model_dir) / "float_model.onnx")
+        model.export(float_model_path, format="onnx")
+
+        import onnxruntime
+        input_name = onnxruntime.InferenceSession(float_model_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+        quantize_static(float_model_path, output_path, DatasetCalibrationReader(input_name),
+                        quant_format=QuantFormat.QDQ, activation_type=QuantType.QInt8, weight_type=QuantType.QInt8)
+
+# compare latency and accuracy of exported model against the keras model, on images of a test dataset folder
+# latency is measured in batches of 64 images, the size of the squares prediction of one board
+def compare_backends(model_path, backend, dataset_folder, samples_count=Params.compare_samples, batch_size=64):
+    model = Common.get_model(model_path)
+    imgs, labels = load_dataset_sample(dataset_folder, model.input_shape[1:3], samples_count)
+
+    results = {}
+    for compared_backend in ["keras", backend]:
+        predict_func = Common.get_predictor(model_path, compared_backend)
+        predict_func(imgs[:batch_size]) # warm up, not measured
+
+        start_time = time.time()
+        probs = np.concatenate([predict_func(imgs[i : i + batch_size]) for i in range(0, len(imgs), batch_size)])
+        batches_count = math.ceil(len(imgs) / batch_size)
+
+        results[compared_backend] = {
+            "predicts": np.argmax(probs, axis=1),
+            "latency_ms": (time.time() - start_time) / batches_count * 1000
+        }
+
+    keras_results, backend_results = results["keras"], results[backend]
+
+    print("Model:", model_path, "Images:", len(imgs))
+    print("keras latency: %.2f ms per %d images, accuracy %.4f" % (keras_results["latency_ms"], batch_size, np.mean(keras_results["predicts"] == labels)))
+    print("%s latency: %.2f ms per %d images, accuracy %.4f" % (backend, backend_results["latency_ms"], batch_size, np.mean(backend_results["predicts"] == labels)))
+    print("Speedup: %.2fx, accuracy delta: %+.4f, predictions agreement: %.4f" % (
+        keras_results["latency_ms"] / backend_results["latency_ms"],
+        np.mean(backend_results["predicts"] == labels) - np.mean(keras_results["predicts"] == labels),
+        np.mean(backend_results["predicts"] == keras_results["predicts"])))
+
+    return results
+
+# python3 main.py --compare-predict <model_path> [batch_size ...]
+def main_compare_predict(args):
+    if len(args) < 1:
+        raise Exception("main.py --compare-predict <model_path> [batch_size ...]")
+
+    compare_keras_predict(args[0], [int(batch_size) for batch_size in args[1:]] or None)
+
+# steady state latency of keras model.predict against the compiled predictor (Common.get_compiled_predictor)
+# batch sizes of one board by default: 64 squares, and the pieces of a board (16 to 32 occupied squares)
+def compare_keras_predict(model_path, batch_sizes=None, runs=20):
+    batch_sizes = batch_sizes or [64, 32, 16]
+    input_shape = tuple(Common.get_model(model_path).input_shape[1:])
+    compiled_predict = Common.get_compiled_predictor(model_path)
+    results = {}
+
+    print("Model:", model_path, "jit_compile:", Params.compiled_jit_compile)
+    for batch_size in batch_sizes:
+        imgs = np.random.default_rng(batch_size).integers(0, 256, (batch_size,) + input_shape, dtype=np.uint8)
+        latencies = {}
+
+        for name, predict_func in [("predict", functools.partial(Common.predict_keras_model, model_path)), ("compiled", compiled_predict)]:
+            probs = predict_func(imgs) # warm up, not measured
+            times = []
+            for _ in range(runs):
+                start_time = time.perf_counter()
+                predict_func(imgs)
+                times.append(time.perf_counter() - start_time)
+            latencies[name] = (np.median(times) * 1000, probs)
+
+        (predict_ms, predict_probs), (compiled_ms, compiled_probs) = latencies["predict"], latencies["compiled"]
+        results[batch_size] = {"predict_ms": predict_ms, "compiled_ms": compiled_ms}
+        print("batch %4d: predict %8.2f ms, compiled %8.2f ms, speedup %.2fx, max probability difference %.2g" % (
+              batch_size, predict_ms, compiled_ms, predict_ms / compiled_ms, np.abs(predict_probs - compiled_probs).max()))
+
+    return results
+
+# random images of a dataset folder with a subfolder per class (same layout used in training)
+# loaded like in training: RGB, resized to the model input (uint8, normalized by the predictors), class index from the sorted subfolder names
+def load_dataset_sample(dataset_folder, input_size, samples_count, seed=123):
+    class_folders = sorted(folder for folder in Path(dataset_folder).iterdir() if folder.is_dir())
+
+    img_paths = [(img_path, class_idx) for class_idx, class_folder in enumerate(class_folders)
+                 for img_path in class_folder.iterdir() if img_path.suffix.lower() in ('.jpg', '.jpeg', '.png')]
+
+    random.Random(seed).shuffle(img_paths)
+    img_paths = img_paths[:samples_count]
+
+    height, width = input_size
+    imgs = np.empty((len(img_paths), height, width, 3), dtype=np.uint8)
+    labels = np.empty(len(img_paths), dtype=np.int32)
+
+    for i, (img_path, class_idx) in enumerate(img_paths):
+        img = cv2.cvtColor(cv2.imread(str(img_path), cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+        imgs[i] = cv2.resize(img, (width, height), interpolation=cv2.INTER_NEAREST)
+        labels[i] = class_idx
+
+    return imgs, labels
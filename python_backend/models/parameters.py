@@ -14,6 +14,26 @@ val_batch_size = test_batch_size = 64
 #model path
 best_squares_model_path = "model_results/occupancy/new_dataset/shuffle3000-val0.05/vanilla_img100/vanilla_img100.keras"
 
+#max number of models kept loaded in memory at the same time (least recently used are evicted)
+max_loaded_models = 4
+
+#runtime used in predictions: "keras", or a model exported by models_export ("tflite", "onnx") next to the .keras file
+inference_backend = "keras"
+
+#models receive the uint8 crops and normalize them inside the graph (keras models with float inputs get a Rescaling layer when loaded)
+#False -> crops normalized to float32 on the host before predicting, like the models were trained
+uint8_model_inputs = True
+
+#keras predictions with the model call compiled in a tf.function, instead of model.predict (per call overhead dominates small batches)
+keras_compiled_predict = True
+compiled_jit_compile = False # XLA compilation, one compiled program per batch bucket
+compiled_batch_buckets = (8, 16, 32, 64, 128, 256, 512) # batch sizes of the compiled programs with jit_compile (batches padded to the next one), bigger batches are split in batches of the last one
+compiled_warmup_batches = (64,) # batch sizes run once when the predictor is loaded
+
+#exported models
+calibration_samples = 200 # images of the dataset used to calibrate int8 quantization
+compare_samples = 512 # images of the dataset used to compare the exported model against the keras one
+
 #square prediction security
 square_threshold_predict = 0.6
 
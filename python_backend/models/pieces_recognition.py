@@ -2,28 +2,29 @@ from models.includes import *
 import models.parameters as Params
 import models.models_common as Common
 import print_funcs.print_funcs as Prints
+import pipeline.instrumentation as Instr
 
 # (depois de fazer "source ~/venv-metal/bin/activate") python3 main.py dataset_input/ model_output
 
 #corner_points = [top_left, top_right, bottom_left, bottom_right]
+# occupation_mask can also be of shape (n_boards, 64), with pieces_img_list holding the pieces of every board in order
 def interpret_pieces(pieces_img_list, occupation_mask):
 
-    model = Common.import_CNN(Params.best_pieces_model_path)
+    final_list = np.zeros(occupation_mask.shape,dtype=np.int32)
+    uncertain_predicts = np.zeros(occupation_mask.shape,dtype=bool)
 
-    pieces_img_list = pieces_img_list.astype(np.float32) # convert to float to avoid overflows
-    pieces_img_list /= 255.0 
+    if len(pieces_img_list) == 0: # no occupied squares, nothing to predict
+        return final_list, uncertain_predicts
 
-    pred_result = model.predict(
-            pieces_img_list,
-            batch_size = Params.batch_size,
-            verbose=2)
+    predict_func = Common.get_predictor(Params.best_pieces_model_path) # receives the uint8 crops, normalized by the model or its backend
+
+    with Instr.stage("pieces_inference", len(pieces_img_list)):
+        pred_result = predict_func(pieces_img_list)
 
     predicts = np.argmax(pred_result, axis=1) + 1 # leave zero value for empty places
     
-    final_list = np.zeros(64,dtype=np.int32)
     final_list[occupation_mask] = predicts
 
-    uncertain_predicts = np.zeros(64,dtype=bool)
     uncertain_predicts[occupation_mask] = np.max(pred_result, axis=1) < Params.square_threshold_predict # register which predicts are uncertain
     
     return final_list, uncertain_predicts
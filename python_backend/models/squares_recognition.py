@@ -1,6 +1,7 @@
 from models.includes import *
 import models.parameters as Params
 import models.models_common as Common
+import pipeline.instrumentation as Instr
 
 # (depois de fazer "source ~/venv-metal/bin/activate") python3 main.py dataset_input/ model_output
 
@@ -9,16 +10,10 @@ import models.models_common as Common
 def interpret_empty_spaces(square_img_list):
 
     # model = import_resnet_CNN_weights(Params.import_squares_resnet_weights_path)
-    model = Common.import_CNN(Params.best_squares_model_path)
+    predict_func = Common.get_predictor(Params.best_squares_model_path) # receives the uint8 crops, normalized by the model or its backend
 
-    #normalizar imagem
-    square_img_list = square_img_list.astype(np.float32) # convert to float to avoid overflows
-    square_img_list /= 255.0 
-
-    pred_result = model.predict(
-            square_img_list,
-            batch_size = Params.batch_size,
-            verbose=2)
+    with Instr.stage("occupancy_inference", len(square_img_list)):
+        pred_result = predict_func(square_img_list)
 
     predicts = np.argmax(pred_result, axis=1)
 
@@ -0,0 +1,134 @@
+from pipeline.includes import *
+import pipeline.parameters as Params
+import process_datasets.parameters as DataParams
+import process_datasets.process_dataset_common as CommonData
+
+"""
+    Ground truth of annotated image folders, and accuracy of the pipeline results against it
+    supported folders:
+        OSF: <name>.png + <name>.json with "fen" and "corners"
+        ChessReD: images + annotations.json (only the annotated images present in the folder are used)
+        any other folder: images without annotations (only speed is measured)
+    samples are dicts: {"image": path, "corners": (4,2) [top_left, top_right, bottom_left, bottom_right] or None, "labels": (64,) fen codes or None}
+"""
+
+def load_dataset(folder_path):
+    folder = Path(folder_path)
+
+    if (folder / "annotations.json").exists():
+        return load_chessred_dataset(folder)
+
+    image_paths = sorted(path for path in folder.iterdir() if path.suffix.lower() in Params.image_extensions)
+    if any(image_path.with_suffix('.json').exists() for image_path in image_paths):
+        return load_osf_dataset(image_paths)
+
+    return [{"image": image_path, "corners": None, "labels": None} for image_path in image_paths]
+
+def load_osf_dataset(image_paths):
+    samples = []
+
+    for image_path in image_paths:
+        json_path = image_path.with_suffix('.json')
+        if not json_path.exists():
+            samples.append({"image": image_path, "corners": None, "labels": None})
+            continue
+
+        with json_path.open('r') as json_file:
+            data = json.load(json_file)
+
+        corners = np.array([data["corners"][1], data["corners"][2], data["corners"][0], data["corners"][3]], dtype=np.float32) # mesma ordem que osf_dataset
+        corners, labels = CommonData.reorder_chessboard(corners, CommonData.fenToVec(data["fen"]))
+        samples.append({"image": image_path, "corners": corners, "labels": labels})
+
+    return samples
+
+def load_chessred_dataset(folder):
+    with (folder / "annotations.json").open('r') as json_file:
+        data = json.load(json_file)
+
+    images = data["images"]
+    pieces = data["annotations"]["pieces"]
+    samples = []
+
+    for corner_obj in data["annotations"]["corners"]:
+        image_path = folder / images[corner_obj["image_id"]]["path"]
+        if not image_path.exists(): # subsets of the dataset keep the full annotations file
+            continue
+
+        corners = np.array([corner_obj["corners"]["top_left"], corner_obj["corners"]["top_right"], corner_obj["corners"]["bottom_left"], corner_obj["corners"]["bottom_right"]], dtype=np.float32)
+        labels = CommonData.listToVec(CommonData.find_range(pieces, "image_id", corner_obj["image_id"]))
+        corners, labels = CommonData.reorder_chessboard(corners, labels)
+        samples.append({"image": image_path, "corners": corners, "labels": labels})
+
+    return samples
+
+# the pipeline corners can come in any of the 8 orientations of the board (rotations and mirrors of the annotated one)
+# returns ground truth labels in the orientation of the predicted corners, and the distance of each predicted corner to its annotated one
+def align_to_prediction(sample, pred_corners):
+    grid = np.arange(64).reshape(8, 8)
+    corner_cells = [(0, 0), (0, 7), (7, 0), (7, 7)] # top_left, top_right, bottom_left, bottom_right
+    corner_of_square = {0: 0, 7: 1, 56: 2, 63: 3}
+    best = None
+
+    for rotations in range(4):
+        for mirrored in (False, True):
+            squares_map = np.rot90(grid, rotations)
+            if mirrored:
+                squares_map = squares_map.T
+
+            # annotated corner that each predicted corner corresponds to, in this orientation
+            matched_corners = sample["corners"][[corner_of_square[squares_map[cell]] for cell in corner_cells]]
+            distances = np.linalg.norm(np.asarray(pred_corners, dtype=np.float32) - matched_corners, axis=1)
+
+            if best is None or distances.sum() < best[1].sum():
+                best = (squares_map.flatten(), distances)
+
+    squares_map, distances = best
+    return sample["labels"][squares_map], distances
+
+# distance of each predicted corner to its annotated one, in squares (comparable between image sizes)
+def corner_errors_squares(sample, corner_distances):
+    side_lengths = np.linalg.norm(sample["corners"][[1, 3, 3, 2]] - sample["corners"][[0, 1, 2, 0]], axis=1)
+    return corner_distances / (side_lengths.mean() / 8)
+
+# corner, occupancy and piece correctness of a single board
+# piece_predicts: final vector of the pipeline (models_predict_to_name codes, with the unknown codes)
+def board_accuracy(sample, pred_corners, piece_predicts):
+    labels, corner_distances = align_to_prediction(sample, pred_corners)
+    piece_predicts = np.asarray(piece_predicts)
+
+    corner_errors = corner_errors_squares(sample, corner_distances)
+
+    label_names = np.array(["empty" if label == 0 else DataParams.fen_to_name[str(int(label))] for label in labels])
+    predict_names = np.array([DataParams.models_predict_to_name[int(code)] for code in piece_predicts])
+
+    occupied = labels != 0
+    occupancy_correct = (piece_predicts != Params.unknown_occupation_code) & ((piece_predicts != 0) == occupied)
+    pieces_correct = predict_names[occupied] == label_names[occupied]
+
+    return {
+        "corner_error_px": float(corner_distances.mean()),
+        "corner_error_squares": float(corner_errors.max()),
+        "corners_correct": bool(corner_errors.max() <= Params.benchmark_corner_tolerance),
+        "occupancy_correct": int(occupancy_correct.sum()),
+        "pieces_correct": int(pieces_correct.sum()),
+        "occupied_squares": int(occupied.sum()),
+        "board_correct": bool((predict_names == label_names).all())
+    }
+
+# accuracy over several boards, annotated boards where recognition failed count as wrong
+def dataset_accuracy(boards_accuracy, failed_samples):
+    annotated_count = len(boards_accuracy) + len(failed_samples)
+    if annotated_count == 0:
+        return None
+
+    occupied_count = sum(board["occupied_squares"] for board in boards_accuracy) + sum(int(np.count_nonzero(sample["labels"])) for sample in failed_samples)
+    return {
+        "annotated_images": annotated_count,
+        "failed_images": len(failed_samples),
+        "corners": sum(board["corners_correct"] for board in boards_accuracy) / annotated_count,
+        "corner_error_px": float(np.mean([board["corner_error_px"] for board in boards_accuracy])) if boards_accuracy else None,
+        "occupancy": sum(board["occupancy_correct"] for board in boards_accuracy) / (64 * annotated_count),
+        "pieces": sum(board["pieces_correct"] for board in boards_accuracy) / max(occupied_count, 1),
+        "boards": sum(board["board_correct"] for board in boards_accuracy) / annotated_count
+    }
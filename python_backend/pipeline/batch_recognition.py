@@ -0,0 +1,140 @@
+from pipeline.includes import *
+import pipeline.parameters as Params
+import pipeline.recognition as Recogn
+import pipeline.instrumentation as Instr
+import pipeline.stage_cache as StageCache
+import models.models_common as ModelsCommon
+
+"""
+    Recognition of many board images at once, joining the crops of several boards in the same model predictions
+"""
+
+# python3 main.py --batch <input_folder | image_path | txt_with_image_paths> ... <output_file_path>
+def main_batch(args):
+    if len(args) < 2:
+        raise Exception("main.py --batch <input_folder | image_path | txt_with_image_paths> ... <output_file_path>")
+
+    image_paths = collect_image_paths(args[:-1])
+    process_images_batch(image_paths, args[-1])
+
+# expand folders (their images, sorted by name) and txt files (one image path per line) into a list of image paths
+def collect_image_paths(inputs):
+    image_paths = []
+
+    for input_path in inputs:
+        input_path = Path(input_path)
+
+        if input_path.is_dir():
+            image_paths.extend(sorted(path for path in input_path.iterdir() if path.suffix.lower() in Params.image_extensions))
+        elif input_path.suffix.lower() == '.txt':
+            with input_path.open('r') as input_file:
+                image_paths.extend(Path(line.strip()) for line in input_file if line.strip())
+        else:
+            image_paths.append(input_path)
+
+    return image_paths
+
+# process images in groups of batch_boards, writing one json line per image to output_file_path
+# if instrumentation is enabled, stages measurements are saved to <output_file_path>.stages.json
+def process_images_batch(image_paths, output_file_path, batch_boards=Params.batch_boards):
+    ModelsCommon.preload_models()
+    Instr.enable_from_params()
+
+    output_path = Path(output_file_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    start_time = time.time()
+
+    with output_path.open('w') as output_file, ThreadPoolExecutor(max_workers=Params.batch_workers) as executor:
+        for i in range(0, len(image_paths), batch_boards):
+            records = process_boards_chunk(image_paths[i : i + batch_boards], executor)
+
+            for record in records:
+                output_file.write(json.dumps(record) + "\n")
+            output_file.flush()
+
+            processed_count = min(i + batch_boards, len(image_paths))
+            print(f"Processed {processed_count}/{len(image_paths)} images")
+
+    elapsed_time = time.time() - start_time
+    print("Execution time: %s s (%.2f images/s)" % (elapsed_time, len(image_paths) / max(elapsed_time, 1e-9)))
+
+    if Instr.is_enabled():
+        Instr.print_summary()
+        Instr.export_json(output_path.with_suffix('.stages.json'))
+        if Params.instrumentation_profile_dir:
+            Instr.dump_profiles()
+
+# cpu stages of each board run in the executor, model stages run once for all boards of the chunk
+# stages already in the stage cache (if enabled) are skipped for each board
+def process_boards_chunk(image_paths, executor):
+    boards = list(executor.map(process_single_board_squares, image_paths))
+
+    squares_boards = [board for board in boards if "error" not in board and "square_predicts" not in board]
+    if squares_boards:
+        predict_boards_squares(squares_boards)
+        for board in squares_boards:
+            StageCache.store("squares", board)
+
+    pieces_boards = [board for board in boards if "error" not in board and "piece_predicts" not in board]
+    if pieces_boards:
+        crop_boards_pieces(pieces_boards, executor)
+
+    pieces_boards = [board for board in pieces_boards if "error" not in board]
+    if pieces_boards:
+        predict_boards_pieces(pieces_boards)
+        for board in pieces_boards:
+            StageCache.store("pieces", board)
+
+    return [board_record(board) for board in boards]
+
+# one occupancy prediction for the squares of every board
+def predict_boards_squares(boards):
+    square_predicts, uncertain_square_predicts = Recogn.predict_boards_squares([board["square_imgs"] for board in boards])
+
+    for board, board_square_predicts, board_uncertain_square_predicts in zip(boards, square_predicts, uncertain_square_predicts):
+        board["square_predicts"] = board_square_predicts
+        board["uncertain_square_predicts"] = board_uncertain_square_predicts
+
+def crop_boards_pieces(boards, executor):
+    list(executor.map(process_single_board_pieces, boards))
+
+# one pieces prediction for the occupied squares of every board
+def predict_boards_pieces(boards):
+    piece_predicts, uncertain_piece_predicts = Recogn.predict_boards_pieces([board["piece_imgs"] for board in boards],
+                                                                            [board["occupation_mask"] for board in boards])
+
+    for board, board_piece_predicts, board_uncertain_piece_predicts in zip(boards, piece_predicts, uncertain_piece_predicts):
+        board["piece_predicts"] = board_piece_predicts
+        board["uncertain_piece_predicts"] = board_uncertain_piece_predicts
+
+# json serializable result of a board
+def board_record(board):
+    if "error" in board:
+        return {"image": str(board["image"]), "error": board["error"]}
+
+    return {
+        "image": str(board["image"]),
+        "corners": board["corner_points"].tolist(),
+        "piece_predicts": board["piece_predicts"].tolist(),
+        "uncertain_square_predicts": board["uncertain_square_predicts"].tolist(),
+        "uncertain_piece_predicts": board["uncertain_piece_predicts"].tolist()
+    }
+
+# read image, find corners and crop squares of a single board, errors are kept to be reported in the output
+def process_single_board_squares(image_path):
+    try:
+        with Instr.image(image_path):
+            return Recogn.process_board_cpu_squares(Recogn.load_board(image_path))
+
+    except Exception as e:
+        traceback.print_exc()
+        return {"image": image_path, "error": str(e)}
+
+def process_single_board_pieces(board):
+    try:
+        with Instr.image(board["image"]):
+            board["piece_imgs"], board["occupation_mask"] = Recogn.process_board_pieces(board["board_img"], board["corner_points"],
+                                                                                        board["square_predicts"], board["warped_board"])
+    except Exception as e:
+        board["error"] = str(e)
@@ -0,0 +1,247 @@
+from pipeline.includes import *
+import pipeline.parameters as Params
+import pipeline.instrumentation as Instr
+import pipeline.annotations as Annotations
+import pipeline.batch_recognition as BatchRecogn
+import models.models_common as ModelsCommon
+import models.parameters as ModelsParams
+import platform
+
+"""
+    End to end benchmark of the recognition pipeline over image folders (the bundled examples, or annotated OSF/ChessReD folders)
+    for each folder:
+        cold: models unloaded -> time to load them, and time of the first image (includes loading and first prediction)
+              tensorflow itself is imported before the first folder, so every folder measures the same cold state
+        warm: benchmark_warm_runs passes over every image with models loaded -> images/s, per stage latency percentiles, max rss
+        accuracy: corners, occupancy and pieces against the annotations, if any
+    the report is saved as json, and can be diffed against a previous report (baseline) to catch regressions
+"""
+
+def main_benchmark(args):
+    baseline_path = None
+    if "--baseline" in args:
+        baseline_index = args.index("--baseline")
+        if baseline_index + 1 >= len(args):
+            raise Exception("main.py --benchmark <output_json_path> [<dataset_folder> ...] [--baseline <baseline_json_path>]")
+        baseline_path = args[baseline_index + 1]
+        args = args[:baseline_index] + args[baseline_index + 2:]
+
+    if len(args) < 1:
+        raise Exception("main.py --benchmark <output_json_path> [<dataset_folder> ...] [--baseline <baseline_json_path>]")
+
+    report = run_benchmark(args[1:] or Params.benchmark_datasets)
+    print_report(report)
+
+    output_path = Path(args[0])
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with output_path.open('w') as output_file:
+        json.dump(report, output_file, indent=2)
+
+    if baseline_path:
+        with open(baseline_path, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+        differences = compare_reports(baseline, report)
+        print_differences(differences)
+
+        if any(difference["regression"] for difference in differences):
+            sys.exit(1)
+
+def run_benchmark(dataset_folders):
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "inference_backend": ModelsParams.inference_backend,
+            "batch_boards": Params.batch_boards,
+            "batch_workers": Params.batch_workers
+        },
+        "datasets": {}
+    }
+
+    ModelsCommon.preload_models() # import inference libraries once, not counted in the first folder cold times
+
+    stage_cache_enabled = Params.stage_cache_enabled
+    Params.stage_cache_enabled = False # warm runs would only measure cache lookups
+    try:
+        for dataset_folder in dataset_folders:
+            samples = Annotations.load_dataset(dataset_folder)
+            if not samples:
+                print(f"No images in {dataset_folder}, skipped")
+                continue
+
+            print(f"Benchmarking {dataset_folder} ({len(samples)} images)")
+            report["datasets"][Path(dataset_folder).name] = benchmark_dataset(samples)
+    finally:
+        Params.stage_cache_enabled = stage_cache_enabled
+
+    return report
+
+def benchmark_dataset(samples):
+    image_paths = [sample["image"] for sample in samples]
+
+    with ThreadPoolExecutor(max_workers=Params.batch_workers) as executor:
+        cold = benchmark_cold(image_paths[0], executor)
+
+        Instr.reset()
+        Instr.enable(track_memory=Params.benchmark_track_memory)
+        try:
+            start_time = time.perf_counter()
+            for _ in range(Params.benchmark_warm_runs):
+                records = process_images(image_paths, executor)
+            warm_time = time.perf_counter() - start_time
+
+            stages = Instr.summary()
+            image_times = [sum(stage_times.values()) for stage_times in Instr.images_breakdown().values()]
+        finally:
+            Instr.disable()
+            Instr.reset()
+
+    warm = {
+        "runs": Params.benchmark_warm_runs,
+        "images_per_s": Params.benchmark_warm_runs * len(image_paths) / warm_time,
+        "failed_images": sum("error" in record for record in records),
+        "image_cpu_stages_ms": percentiles_ms(image_times), # stages of a single image (decode, corners, warp, crops), models are shared by the batch
+        "stages": {name: {"count": stage["count"], "wall_ms": {key: value * 1000 for key, value in stage["wall"].items()},
+                          "cpu_ms": {key: value * 1000 for key, value in stage["cpu"].items()},
+                          **({"peak_memory": stage["peak_memory"]} if "peak_memory" in stage else {})}
+                   for name, stage in stages.items()}
+    }
+
+    return {
+        "images": len(samples),
+        "cold": cold,
+        "warm": warm,
+        "memory": {"max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024},
+        "accuracy": samples_accuracy(samples, records)
+    }
+
+# models unloaded: time to load them, then time of a first image with freshly loaded models
+def benchmark_cold(image_path, executor):
+    ModelsCommon.unload_models()
+    start_time = time.perf_counter()
+    ModelsCommon.preload_models()
+    load_time = time.perf_counter() - start_time
+
+    ModelsCommon.unload_models()
+    start_time = time.perf_counter()
+    process_images([image_path], executor)
+    first_image_time = time.perf_counter() - start_time
+
+    return {"models_load_s": load_time, "first_image_s": first_image_time}
+
+def process_images(image_paths, executor):
+    records = []
+    for i in range(0, len(image_paths), Params.batch_boards):
+        records.extend(BatchRecogn.process_boards_chunk(image_paths[i : i + Params.batch_boards], executor))
+    return records
+
+def samples_accuracy(samples, records):
+    boards_accuracy, failed_samples = [], []
+
+    for sample, record in zip(samples, records):
+        if sample["labels"] is None:
+            continue
+
+        if "error" in record:
+            failed_samples.append(sample)
+            continue
+
+        piece_predicts = np.array(record["piece_predicts"])
+        piece_predicts[record["uncertain_piece_predicts"]] = Params.unknown_piece_code
+        piece_predicts[record["uncertain_square_predicts"]] = Params.unknown_occupation_code
+        boards_accuracy.append(Annotations.board_accuracy(sample, np.array(record["corners"]), piece_predicts))
+
+    return Annotations.dataset_accuracy(boards_accuracy, failed_samples)
+
+def percentiles_ms(values):
+    if not values:
+        return None
+    return {"p%d" % p: float(np.percentile(values, p)) * 1000 for p in Params.instrumentation_percentiles}
+
+# baseline diff
+
+# (metric path, higher is better, tolerance kind) compared for every dataset present in both reports
+def compared_metrics(dataset_report):
+    metrics = [
+        (("warm", "images_per_s"), True, "time"),
+        (("cold", "first_image_s"), False, "time"),
+        (("cold", "models_load_s"), False, "time"),
+        (("memory", "max_rss_bytes"), False, "memory"),
+    ]
+    for name in dataset_report["warm"]["stages"]:
+        for p in Params.benchmark_compared_percentiles:
+            metrics.append((("warm", "stages", name, "wall_ms", "p%d" % p), False, "time"))
+    if dataset_report.get("accuracy"):
+        for name in ("corners", "occupancy", "pieces", "boards"):
+            metrics.append((("accuracy", name), True, "accuracy"))
+    return metrics
+
+def get_path(report, path):
+    for key in path:
+        if not isinstance(report, dict) or key not in report:
+            return None
+        report = report[key]
+    return report
+
+def compare_reports(baseline, report):
+    tolerances = {"time": Params.benchmark_time_tolerance, "memory": Params.benchmark_memory_tolerance, "accuracy": Params.benchmark_accuracy_tolerance}
+    differences = []
+
+    for dataset_name, dataset_report in report["datasets"].items():
+        baseline_dataset = baseline["datasets"].get(dataset_name)
+        if baseline_dataset is None:
+            continue
+
+        for path, higher_is_better, tolerance_kind in compared_metrics(dataset_report):
+            old_value, new_value = get_path(baseline_dataset, path), get_path(dataset_report, path)
+            if old_value is None or new_value is None:
+                continue
+
+            change = new_value - old_value
+            small_change = path[-2:-1] == ("wall_ms",) and abs(change) < Params.benchmark_min_time_change_ms # noise of fast stages
+            if tolerance_kind != "accuracy": # relative change for times and memory, absolute for accuracies
+                change = change / old_value if old_value else 0.0
+
+            worse_change = -change if higher_is_better else change
+            differences.append({
+                "dataset": dataset_name,
+                "metric": ".".join(path),
+                "baseline": old_value,
+                "current": new_value,
+                "change": change,
+                "regression": worse_change > tolerances[tolerance_kind] and not small_change
+            })
+
+    return differences
+
+# printing
+
+def print_report(report):
+    for dataset_name, dataset_report in report["datasets"].items():
+        warm, cold = dataset_report["warm"], dataset_report["cold"]
+        print(f"\n{dataset_name}: {dataset_report['images']} images, {warm['images_per_s']:.2f} images/s warm, "
+              f"first image cold {cold['first_image_s']:.2f} s (models load {cold['models_load_s']:.2f} s), "
+              f"max rss {dataset_report['memory']['max_rss_bytes'] / 2**20:.0f} MB")
+
+        print("  %-22s %6s %10s %10s %10s" % ("stage", "count", "p50 ms", "p95 ms", "p99 ms"))
+        for name, stage in warm["stages"].items():
+            print("  %-22s %6d %10.2f %10.2f %10.2f" % (name, stage["count"], stage["wall_ms"]["p50"], stage["wall_ms"]["p95"], stage["wall_ms"]["p99"]))
+
+        accuracy = dataset_report["accuracy"]
+        if accuracy:
+            print(f"  accuracy ({accuracy['annotated_images']} annotated, {accuracy['failed_images']} failed): corners {accuracy['corners']:.3f}, "
+                  f"occupancy {accuracy['occupancy']:.3f}, pieces {accuracy['pieces']:.3f}, boards {accuracy['boards']:.3f}")
+
+def print_differences(differences):
+    print("\nChanges against baseline:")
+    for difference in differences:
+        if difference["regression"] or abs(difference["change"]) > 0.05:
+            print("  %-10s %-20s %-45s %12.4g -> %-12.4g %+.3f" % ("REGRESSION" if difference["regression"] else "", difference["dataset"],
+                  difference["metric"], difference["baseline"], difference["current"], difference["change"]))
+
+    regressions = sum(difference["regression"] for difference in differences)
+    print(f"  {regressions} regressions in {len(differences)} compared metrics")
@@ -0,0 +1,179 @@
+from pipeline.includes import *
+import pipeline.parameters as Params
+import pipeline.annotations as Annotations
+import board_recognition.board_recognition as BoardRecogn
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import os
+
+"""
+    Accuracy and speed of the board corners detection (process_board only, no models) over annotated folders (see Annotations)
+    every image is detected in a process pool, and for each one:
+        corner error: distance of each corner to the annotated one, in the best of the 8 orientations of the board (px, and squares)
+        failure: exception in the detection (no lines, grid rejected, ...)
+        latency: decode and detection wall time, measured inside the worker
+    per image rows are saved to a csv, the summary to <csv>.summary.json, and compared to a baseline summary if given
+"""
+
+csv_columns = ["dataset", "image", "annotated", "status", "error", "decode_ms", "detect_ms", "corner_error_px", "max_corner_error_px",
+               "max_corner_error_squares", "corners_correct",
+               "top_left_x", "top_left_y", "top_right_x", "top_right_y", "bottom_left_x", "bottom_left_y", "bottom_right_x", "bottom_right_y"]
+
+def main_corners_harness(args):
+    baseline_path = None
+    if "--baseline" in args:
+        baseline_index = args.index("--baseline")
+        if baseline_index + 1 >= len(args):
+            raise Exception("main.py --corners-bench <output_csv_path> <dataset_folder> ... [--baseline <baseline_summary_json_path>]")
+        baseline_path = args[baseline_index + 1]
+        args = args[:baseline_index] + args[baseline_index + 2:]
+
+    if len(args) < 2:
+        raise Exception("main.py --corners-bench <output_csv_path> <dataset_folder> ... [--baseline <baseline_summary_json_path>]")
+
+    output_path = Path(args[0])
+    rows = run_corners_harness(args[1:])
+    summary = corners_summary(rows)
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with output_path.open('w', newline='') as output_file:
+        writer = csv.DictWriter(output_file, fieldnames=csv_columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    with output_path.with_suffix('.summary.json').open('w') as summary_file:
+        json.dump(summary, summary_file, indent=2)
+
+    print_summary(summary)
+
+    if baseline_path:
+        with open(baseline_path, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+        regressions = compare_summaries(baseline, summary)
+        for regression in regressions:
+            print("  REGRESSION %s" % regression)
+        print(f"  {len(regressions)} regressions against {baseline_path}")
+
+        if regressions:
+            sys.exit(1)
+
+def run_corners_harness(dataset_folders):
+    jobs = []
+    for dataset_folder in dataset_folders:
+        samples = Annotations.load_dataset(dataset_folder)
+        print(f"{dataset_folder}: {len(samples)} images, {sum(sample['corners'] is not None for sample in samples)} annotated")
+        jobs.extend((Path(dataset_folder).name, sample) for sample in samples)
+
+    with ProcessPoolExecutor(max_workers=Params.corners_harness_workers or os.cpu_count()) as executor:
+        detections = list(executor.map(detect_sample_corners, [str(sample["image"]) for _, sample in jobs], chunksize=4))
+
+    return [corners_row(dataset_name, sample, detection) for (dataset_name, sample), detection in zip(jobs, detections)]
+
+# worker: (corners or None, error message or None, decode seconds, detection seconds)
+def detect_sample_corners(image_path):
+    start_time = time.perf_counter()
+    board_img = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    decode_time = time.perf_counter() - start_time
+
+    if board_img is None:
+        return None, "Error opening image", decode_time, 0.0
+
+    start_time = time.perf_counter()
+    try:
+        corner_points = BoardRecogn.process_board(board_img)
+        error = None
+    except Exception as e:
+        corner_points, error = None, str(e)
+    detect_time = time.perf_counter() - start_time
+
+    return corner_points, error, decode_time, detect_time
+
+def corners_row(dataset_name, sample, detection):
+    corner_points, error, decode_time, detect_time = detection
+    row = {column: "" for column in csv_columns}
+    row.update({"dataset": dataset_name, "image": str(sample["image"]), "annotated": sample["corners"] is not None,
+                "status": "failed" if corner_points is None else "ok",
+                "error": error or "", "decode_ms": round(decode_time * 1000, 3), "detect_ms": round(detect_time * 1000, 3)})
+
+    if corner_points is None:
+        return row
+
+    row.update(zip(csv_columns[-8:], (round(float(value), 2) for value in np.asarray(corner_points).reshape(-1))))
+
+    if sample["corners"] is not None:
+        _, corner_distances = Annotations.align_to_prediction(sample, corner_points)
+        corner_errors = Annotations.corner_errors_squares(sample, corner_distances)
+        row.update({"corner_error_px": round(float(corner_distances.mean()), 3), "max_corner_error_px": round(float(corner_distances.max()), 3),
+                    "max_corner_error_squares": round(float(corner_errors.max()), 4),
+                    "corners_correct": bool(corner_errors.max() <= Params.benchmark_corner_tolerance)})
+
+    return row
+
+def corners_summary(rows):
+    summary = {"datasets": {}}
+    for dataset_name in dict.fromkeys(row["dataset"] for row in rows):
+        summary["datasets"][dataset_name] = rows_summary([row for row in rows if row["dataset"] == dataset_name])
+    summary["all"] = rows_summary(rows)
+    return summary
+
+# annotated images where detection failed count as wrong corners
+def rows_summary(rows):
+    detected = [row for row in rows if row["status"] == "ok"]
+    annotated = [row for row in rows if row["annotated"]]
+    evaluated = [row for row in detected if row["annotated"]]
+    detect_times = [row["detect_ms"] for row in rows]
+
+    summary = {
+        "images": len(rows),
+        "failed": len(rows) - len(detected),
+        "failure_rate": (len(rows) - len(detected)) / max(len(rows), 1),
+        "annotated": len(annotated),
+        "corners_accuracy": sum(row["corners_correct"] is True for row in evaluated) / len(annotated) if annotated else None,
+        "detect_ms": {"mean": float(np.mean(detect_times)), **{"p%d" % p: float(np.percentile(detect_times, p)) for p in Params.instrumentation_percentiles}} if detect_times else None,
+        "corner_error_px": None,
+        "max_corner_error_squares": None
+    }
+
+    if evaluated:
+        errors_px = np.array([row["corner_error_px"] for row in evaluated])
+        errors_squares = np.array([row["max_corner_error_squares"] for row in evaluated])
+        summary["corner_error_px"] = {"mean": float(errors_px.mean()), "p50": float(np.median(errors_px)), "p95": float(np.percentile(errors_px, 95))}
+        summary["max_corner_error_squares"] = {"p50": float(np.median(errors_squares)), "p95": float(np.percentile(errors_squares, 95))}
+
+    return summary
+
+# regressions of each dataset present in both summaries: corners accuracy, failure rate and median detection time
+# (same tolerances as the end to end benchmark)
+def compare_summaries(baseline, summary):
+    regressions = []
+
+    for dataset_name, dataset_summary in summary["datasets"].items():
+        baseline_summary = baseline["datasets"].get(dataset_name)
+        if baseline_summary is None:
+            continue
+
+        old_accuracy, new_accuracy = baseline_summary["corners_accuracy"], dataset_summary["corners_accuracy"]
+        if old_accuracy is not None and new_accuracy is not None and old_accuracy - new_accuracy > Params.benchmark_accuracy_tolerance:
+            regressions.append(f"{dataset_name}: corners accuracy {old_accuracy:.3f} -> {new_accuracy:.3f}")
+
+        if dataset_summary["failure_rate"] - baseline_summary["failure_rate"] > Params.corners_harness_failure_tolerance:
+            regressions.append(f"{dataset_name}: failure rate {baseline_summary['failure_rate']:.3f} -> {dataset_summary['failure_rate']:.3f}")
+
+        if baseline_summary["detect_ms"] and dataset_summary["detect_ms"]:
+            old_time, new_time = baseline_summary["detect_ms"]["p50"], dataset_summary["detect_ms"]["p50"]
+            if new_time - old_time > max(old_time * Params.benchmark_time_tolerance, Params.benchmark_min_time_change_ms):
+                regressions.append(f"{dataset_name}: p50 detection {old_time:.1f} ms -> {new_time:.1f} ms")
+
+    return regressions
+
+def print_summary(summary):
+    print("\n  %-24s %7s %7s %9s %9s %11s %11s %9s %9s" % ("dataset", "images", "failed", "annotated", "accuracy", "err px p50", "err px p95", "p50 ms", "p95 ms"))
+    for dataset_name, dataset_summary in list(summary["datasets"].items()) + [("all", summary["all"])]:
+        accuracy = dataset_summary["corners_accuracy"]
+        errors = dataset_summary["corner_error_px"]
+        times = dataset_summary["detect_ms"]
+        print("  %-24s %7d %7d %9d %9s %11s %11s %9.1f %9.1f" % (
+              dataset_name, dataset_summary["images"], dataset_summary["failed"], dataset_summary["annotated"],
+              "-" if accuracy is None else "%.3f" % accuracy, "-" if errors is None else "%.1f" % errors["p50"],
+              "-" if errors is None else "%.1f" % errors["p95"], times["p50"] if times else 0.0, times["p95"] if times else 0.0))
@@ -0,0 +1,17 @@
+import cv2
+import numpy as np
+import sys
+import json
+import time
+import traceback
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import itertools
+import threading
+import contextlib
+import tracemalloc
+import cProfile
+import resource
+from collections import defaultdict
@@ -0,0 +1,126 @@
+from pipeline.includes import *
+import pipeline.parameters as Params
+import pipeline.instrumentation as Instr
+import pipeline.recognition as Recogn
+import models.squares_recognition as ModelsSquares
+import models.pieces_recognition as ModelsPieces
+
+"""
+    Incremental recognition of consecutive images of the same game
+    keeps a signature (thumbnail or perceptual hash) of each square and piece crop, taken when it was last classified
+    only crops whose signature changed go to the models, the labels of the other squares are reused
+    comparing against the crop of the last classification (and not the previous frame) avoids missing slow drifts
+"""
+
+def new_board_state():
+    return {
+        "square_signatures": None, # (64, ...) signature of each square crop, when it was last classified
+        "square_predicts": np.zeros(64, dtype=np.int64),
+        "uncertain_square_predicts": np.zeros(64, dtype=bool),
+        "piece_signatures": None, # (64, ...) signature of each piece crop, when it was last classified
+        "piece_signatures_valid": np.zeros(64, dtype=bool), # squares without piece signature (empty the last time)
+        "piece_predicts": np.zeros(64, dtype=np.int32),
+        "uncertain_piece_predicts": np.zeros(64, dtype=bool),
+        "frames_since_refresh": 0
+    }
+
+def reset_board_state(board_state):
+    board_state.update(new_board_state())
+
+# same results as a full recognition of the board, but only changed squares are classified
+# returns the result of the board and the state is updated in place
+def recognize_incremental(board_state, board_img, corner_points):
+    full_refresh = board_state["square_signatures"] is None or refresh_due(board_state)
+
+    warped_board, square_imgs = Recogn.process_corners_squares(board_img, corner_points)
+    changed_squares = update_squares(board_state, square_imgs, full_refresh)
+
+    piece_imgs, occupation_mask = Recogn.process_board_pieces(board_img, corner_points, board_state["square_predicts"], warped_board)
+    changed_pieces = update_pieces(board_state, piece_imgs, occupation_mask, changed_squares, full_refresh)
+
+    board_state["frames_since_refresh"] = 0 if full_refresh else board_state["frames_since_refresh"] + 1
+
+    return {
+        "piece_predicts": Recogn.merge_predicts(board_state["piece_predicts"], board_state["uncertain_square_predicts"], board_state["uncertain_piece_predicts"]).tolist(),
+        "uncertain_square_predicts": board_state["uncertain_square_predicts"].tolist(),
+        "uncertain_piece_predicts": board_state["uncertain_piece_predicts"].tolist(),
+        "classified_squares": int(changed_squares.sum()),
+        "classified_pieces": int(changed_pieces.sum())
+    }
+
+def refresh_due(board_state):
+    return Params.incremental_refresh_interval > 0 and board_state["frames_since_refresh"] + 1 >= Params.incremental_refresh_interval
+
+# occupancy model only for the squares whose crop changed, returns mask of those squares
+def update_squares(board_state, square_imgs, full_refresh):
+    with Instr.stage("change_detection", len(square_imgs)):
+        signatures = crops_signatures(square_imgs)
+
+        if full_refresh:
+            board_state["square_signatures"] = signatures
+            changed_squares = np.ones(64, dtype=bool)
+        else:
+            changed_squares = crops_changed(board_state["square_signatures"], signatures)
+            board_state["square_signatures"][changed_squares] = signatures[changed_squares]
+
+    if changed_squares.any():
+        square_predicts, uncertain_square_predicts = ModelsSquares.interpret_empty_spaces(square_imgs[changed_squares])
+        board_state["square_predicts"][changed_squares] = square_predicts
+        board_state["uncertain_square_predicts"][changed_squares] = uncertain_square_predicts
+
+    return changed_squares
+
+# pieces model only for occupied squares whose piece crop changed (or whose square changed), returns mask of those squares
+# piece crops are taller than the squares, so a piece crop can change without its own square changing
+def update_pieces(board_state, piece_imgs, occupation_mask, changed_squares, full_refresh):
+    changed_pieces = np.zeros(64, dtype=bool)
+
+    with Instr.stage("change_detection", len(piece_imgs)):
+        if len(piece_imgs) > 0:
+            signatures = crops_signatures(piece_imgs)
+
+            if board_state["piece_signatures"] is None:
+                board_state["piece_signatures"] = np.zeros((64,) + signatures.shape[1:], dtype=signatures.dtype)
+
+            if full_refresh:
+                changed_pieces[occupation_mask] = True
+            else:
+                had_signature = board_state["piece_signatures_valid"][occupation_mask]
+                crop_changed = crops_changed(board_state["piece_signatures"][occupation_mask], signatures)
+                changed_pieces[occupation_mask] = ~had_signature | crop_changed | changed_squares[occupation_mask]
+
+            changed_crops = changed_pieces[occupation_mask] # piece imgs are in the order of the occupied squares
+            board_state["piece_signatures"][changed_pieces] = signatures[changed_crops]
+
+    # squares that became empty (or uncertain) don't keep old pieces
+    board_state["piece_signatures_valid"] = (board_state["piece_signatures_valid"] & occupation_mask) | changed_pieces
+    board_state["piece_predicts"][~occupation_mask] = 0
+    board_state["uncertain_piece_predicts"][~occupation_mask] = False
+
+    if changed_pieces.any():
+        piece_predicts, uncertain_piece_predicts = ModelsPieces.interpret_pieces(piece_imgs[changed_pieces[occupation_mask]], changed_pieces)
+        board_state["piece_predicts"][changed_pieces] = piece_predicts[changed_pieces]
+        board_state["uncertain_piece_predicts"][changed_pieces] = uncertain_piece_predicts[changed_pieces]
+
+    return changed_pieces
+
+# cheap signature of each crop, depends on the change test
+#   diff: greyscale thumbnail without its mean brightness (not affected by camera exposure changes)
+#   dhash: 64 bits, if each pixel of a 9x8 greyscale thumbnail is brighter than its right neighbour
+def crops_signatures(crop_imgs, change_test=Params.incremental_change_test):
+    thumb_size = (9, 8) if change_test == "dhash" else (Params.incremental_thumb_size, Params.incremental_thumb_size)
+    thumbs = np.stack([cv2.resize(cv2.cvtColor(crop_img, cv2.COLOR_BGR2GRAY), thumb_size, interpolation=cv2.INTER_AREA) for crop_img in crop_imgs]).astype(np.float32)
+
+    if change_test == "dhash":
+        return (thumbs[:, :, 1:] > thumbs[:, :, :-1]).reshape(len(thumbs), -1)
+    if change_test == "diff":
+        return thumbs - thumbs.mean(axis=(1, 2), keepdims=True)
+
+    raise Exception("Unknown change test:", change_test)
+
+# mask of the crops whose signature differs from the reference one
+def crops_changed(ref_signatures, signatures, change_test=Params.incremental_change_test):
+    if change_test == "dhash":
+        return np.count_nonzero(ref_signatures != signatures, axis=1) >= Params.incremental_hash_threshold
+
+    return np.abs(signatures - ref_signatures).mean(axis=(1, 2)) > Params.incremental_diff_threshold
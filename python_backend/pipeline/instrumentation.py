@@ -0,0 +1,211 @@
+from pipeline.includes import *
+import pipeline.parameters as Params
+
+"""
+    Per stage measurements of the recognition pipeline: wall time, cpu time and memory, for each image
+    disabled by default, stage() then returns a shared no-op context manager
+
+    usage:
+        with Instr.stage("hough"):
+            ...
+
+    tracemalloc peak and cProfile are process-wide: they are only taken for stages that run while no other thread is inside a stage
+    (a single-threaded run), stages that overlap stages of other threads (batch/server workers, detection sweep) get wall/cpu time only
+"""
+
+_enabled = False
+_track_memory = False
+_profile_dir = None
+
+_records = defaultdict(list) # stage name -> list of measurements
+_profiles = {} # stage name -> cProfile.Profile accumulated over every run of the stage
+_records_lock = threading.Lock()
+
+_current = threading.local() # image being processed by each thread, if a profiler is already running in it, stages open in it
+_active_threads = 0 # threads inside a measured stage
+_overlaps = 0 # times a thread entered a stage while another thread was inside one
+_disabled_stage = contextlib.nullcontext()
+
+def enable(track_memory=False, profile_dir=None):
+    global _enabled, _track_memory, _profile_dir
+    _enabled, _track_memory, _profile_dir = True, track_memory, profile_dir
+
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable():
+    global _enabled
+    _enabled = False
+
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    with _records_lock:
+        _records.clear()
+        _profiles.clear()
+
+# stages measured inside this context are associated to image_id, in the current thread
+@contextlib.contextmanager
+def image(image_id):
+    previous_image_id = getattr(_current, "image_id", None)
+    _current.image_id = str(image_id)
+    try:
+        yield
+    finally:
+        _current.image_id = previous_image_id
+
+def stage(name, items_count=None):
+    if not _enabled:
+        return _disabled_stage
+    return _measured_stage(name, items_count)
+
+# items_count: number of images/crops processed in the stage, for stages shared by several images (ex: batched predictions)
+@contextlib.contextmanager
+def _measured_stage(name, items_count):
+    global _active_threads, _overlaps
+    open_peaks = _current.__dict__.setdefault("open_peaks", []) # peak traced memory seen by each open stage of this thread (nested stages)
+
+    with _records_lock:
+        if not open_peaks:
+            _overlaps += _active_threads > 0
+            _active_threads += 1
+        alone = _active_threads == 1
+        start_overlaps = _overlaps
+
+    profiler = None
+    if alone and _profile_dir is not None and not getattr(_current, "profiling", False): # only one profiler can run per thread
+        with _records_lock:
+            profiler = _profiles.setdefault(name, cProfile.Profile())
+        _current.profiling = True
+        profiler.enable()
+
+    track_memory = alone and _track_memory
+    if track_memory:
+        start_traced_memory, peak_traced_memory = tracemalloc.get_traced_memory()
+        open_peaks[:] = [max(peak, peak_traced_memory) for peak in open_peaks] # reset_peak below would lose the peak of the outer stages
+        tracemalloc.reset_peak()
+    open_peaks.append(0)
+
+    start_wall = time.perf_counter()
+    start_cpu = time.thread_time()
+    try:
+        yield
+    finally:
+        wall_time = time.perf_counter() - start_wall
+        cpu_time = time.thread_time() - start_cpu
+
+        if profiler is not None:
+            profiler.disable()
+            _current.profiling = False
+
+        stage_peak = open_peaks.pop()
+        if track_memory:
+            stage_peak = max(stage_peak, tracemalloc.get_traced_memory()[1])
+            if open_peaks:
+                open_peaks[-1] = max(open_peaks[-1], stage_peak)
+
+        with _records_lock:
+            if not open_peaks:
+                _active_threads -= 1
+            track_memory = track_memory and _overlaps == start_overlaps # another thread started a stage meanwhile -> its allocations are mixed in
+
+        record = {
+            "image": getattr(_current, "image_id", None),
+            "wall": wall_time,
+            "cpu": cpu_time,
+            "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, # linux reports KB
+            "items": items_count
+        }
+        if track_memory:
+            record["peak_memory"] = stage_peak - start_traced_memory
+
+        with _records_lock:
+            _records[name].append(record)
+
+#exports
+
+# aggregated values of each stage: count, percentiles of wall and cpu time (seconds), peak memory (bytes)
+def summary(percentiles=Params.instrumentation_percentiles):
+    with _records_lock:
+        records = {name: list(stage_records) for name, stage_records in _records.items()}
+
+    stages_summary = {}
+    for name, stage_records in records.items():
+        stage_summary = {"count": len(stage_records)}
+
+        for field in ("wall", "cpu"):
+            values = np.array([record[field] for record in stage_records])
+            stage_summary[field] = {"sum": float(values.sum()), "mean": float(values.mean())}
+            stage_summary[field].update({"p%d" % p: float(np.percentile(values, p)) for p in percentiles})
+
+        stage_summary["max_rss"] = max(record["max_rss"] for record in stage_records)
+        peak_memories = [record["peak_memory"] for record in stage_records if "peak_memory" in record] # only single-threaded runs of the stage
+        if peak_memories:
+            stage_summary["peak_memory"] = max(peak_memories)
+
+        stages_summary[name] = stage_summary
+
+    return stages_summary
+
+# wall time of each stage, for each image (stages shared by several images are left out)
+def images_breakdown():
+    breakdown = defaultdict(lambda: defaultdict(float))
+
+    with _records_lock:
+        for name, stage_records in _records.items():
+            for record in stage_records:
+                if record["image"] is not None:
+                    breakdown[record["image"]][name] += record["wall"]
+
+    return {image_id: dict(stages) for image_id, stages in breakdown.items()}
+
+def export_json(output_path):
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with output_path.open('w') as output_file:
+        json.dump({"stages": summary(), "images": images_breakdown()}, output_file, indent=2)
+
+# prometheus text exposition format, stage percentiles as summaries
+def export_prometheus(percentiles=Params.instrumentation_percentiles):
+    lines = []
+
+    for field in ("wall", "cpu"):
+        metric = "chessstate_stage_%s_seconds" % field
+        lines.append("# TYPE %s summary" % metric)
+
+        for name, stage_summary in summary(percentiles).items():
+            for p in percentiles:
+                lines.append('%s{stage="%s",quantile="%s"} %.6f' % (metric, name, p / 100, stage_summary[field]["p%d" % p]))
+            lines.append('%s_sum{stage="%s"} %.6f' % (metric, name, stage_summary[field]["sum"]))
+            lines.append('%s_count{stage="%s"} %d' % (metric, name, stage_summary["count"]))
+
+    lines.append("# TYPE chessstate_max_rss_bytes gauge")
+    lines.append("chessstate_max_rss_bytes %d" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024))
+
+    return "\n".join(lines) + "\n"
+
+# one .prof file per stage, readable with pstats/snakeviz
+def dump_profiles(profile_dir=None):
+    profile_dir = Path(profile_dir or _profile_dir)
+    profile_dir.mkdir(parents=True, exist_ok=True)
+
+    with _records_lock:
+        for name, profiler in _profiles.items():
+            profiler.dump_stats(str(profile_dir / (name + ".prof")))
+
+def print_summary():
+    print("%-22s %6s %10s %10s %10s %10s" % ("stage", "count", "p50 ms", "p95 ms", "p99 ms", "cpu p50 ms"))
+    for name, stage_summary in summary().items():
+        print("%-22s %6d %10.2f %10.2f %10.2f %10.2f" % (name, stage_summary["count"],
+              stage_summary["wall"]["p50"] * 1000, stage_summary["wall"]["p95"] * 1000,
+              stage_summary["wall"]["p99"] * 1000, stage_summary["cpu"]["p50"] * 1000))
+
+# enable with the values of parameters.py, if instrumentation_enabled
+def enable_from_params():
+    if Params.instrumentation_enabled:
+        enable(Params.instrumentation_track_memory, Params.instrumentation_profile_dir)
@@ -0,0 +1,35 @@
+import importlib
+import sys
+
+"""
+    Deferred imports for heavy dependencies (tensorflow, keras, sklearn, scipy, matplotlib, tqdm)
+    The real module is only imported the first time one of its attributes is used, so commands that never touch it don't pay for it at startup
+"""
+
+class LazyModule:
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._module = None
+
+    def __getattr__(self, attr_name): # só chamado para atributos que não existem na instância -> primeiro uso importa o módulo real
+        if self._module is None:
+            self._module = importlib.import_module(self._module_name)
+        return getattr(self._module, attr_name)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._module_name}' ({state})>"
+
+def lazy_module(module_name):
+    return LazyModule(module_name)
+
+# stand-in for "from module import name" when name is a function/class that is only ever called
+def lazy_callable(module_name, attr_name):
+    def call(*args, **kwargs):
+        return getattr(importlib.import_module(module_name), attr_name)(*args, **kwargs)
+    call.__name__ = attr_name
+    call.__qualname__ = attr_name
+    return call
+
+def is_loaded(module_name):
+    return module_name in sys.modules
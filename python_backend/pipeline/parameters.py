@@ -0,0 +1,76 @@
+#batch recognition
+batch_boards = 16 # number of boards whose crops are joined in the same model predictions
+batch_workers = 8 # threads running the cpu stages of each board (opencv releases the GIL)
+squares_crop_views = True # squares crops of batched/served boards kept as views of the warped board, copied only into the occupancy batch
+image_extensions = ('.jpg', '.jpeg', '.png')
+
+#codes of uncertain predictions in final pieces vector (same as models_predict_to_name)
+unknown_occupation_code = 13
+unknown_piece_code = 14
+
+#inference server
+server_host = "127.0.0.1"
+server_port = 8000
+server_workers = 8 # threads running the cpu stages of requests (decode, corners, crops)
+server_max_batch_boards = 16 # max number of boards joined in the same model prediction
+server_max_wait = 0.01 # seconds a prediction waits for crops of other requests, after the first one arrives
+server_max_body_size = 32 * 1024 * 1024 # bytes
+
+#instrumentation of pipeline stages
+instrumentation_enabled = False
+instrumentation_track_memory = False # tracemalloc peak of each stage, slows down the pipeline noticeably
+instrumentation_profile_dir = None # if set, a cProfile .prof file is dumped per stage in this folder
+instrumentation_percentiles = (50, 95, 99)
+
+#startup benchmark
+startup_bench_target = "import main" # code whose cold start is measured, in a fresh interpreter
+startup_bench_runs = 5
+startup_budget_ms = 1500 # cumulative import time above this is reported as a regression
+startup_forbidden_modules = ('tensorflow', 'keras', 'sklearn', 'scipy', 'matplotlib', 'tqdm') # must only be imported when first used
+startup_report_top = 15 # slowest imports (target and its direct imports) shown in the report
+
+#stream recognition (video / camera frames)
+stream_max_features = 200 # features tracked inside the board, between consecutive frames
+stream_feature_quality = 0.01 # goodFeaturesToTrack quality level
+stream_feature_min_distance = 7 # pixels
+stream_board_mask_margin = 0.05 # board polygon is enlarged by this fraction of its size, when seeding features
+stream_lk_window = (21, 21) # sparse optical flow window
+stream_lk_levels = 3 # pyramid levels of sparse optical flow
+stream_max_fb_error = 1.0 # pixels, max forward-backward error of a tracked feature
+stream_min_tracked_features = 20 # below this, corners are detected again
+stream_min_inlier_ratio = 0.7 # fraction of tracked features consistent with the frame to frame homography, below this corners are detected again
+stream_ransac_threshold = 2.0 # pixels
+stream_static_threshold = 0.3 # pixels, median feature motion since the last corners update below this keeps the previous corners
+stream_max_area_change = 0.2 # max relative change of the board area between consecutive frames
+stream_redetect_interval = 300 # frames, full detection runs at least this often (0 -> never forced)
+
+#incremental recognition (only squares that changed since they were last classified go to the models)
+stream_incremental = True # stream mode reuses the labels of unchanged squares
+incremental_change_test = "diff" # "diff" (mean abs difference of thumbnails) or "dhash" (difference hash)
+incremental_thumb_size = 16 # side of the greyscale thumbnail compared by the "diff" test
+incremental_diff_threshold = 6.0 # intensity levels, mean abs difference after removing each thumbnail mean brightness
+incremental_hash_threshold = 8 # bits (of 64) that must differ in the "dhash" test
+incremental_refresh_interval = 100 # frames, every square is classified again at least this often (0 -> never forced)
+
+#benchmark suite
+benchmark_datasets = ('examples/small_osf_test', 'examples/small_chessred_test', 'examples/small_roboflow_test', 'examples/mine') # default folders
+benchmark_warm_runs = 2 # passes over each folder with models already loaded
+benchmark_track_memory = False # tracemalloc peak per stage (slower), max rss is always reported
+benchmark_corner_tolerance = 0.25 # squares, max distance of a predicted corner to the annotated one to count as correct
+benchmark_time_tolerance = 0.15 # relative change of a time/throughput metric reported as a regression
+benchmark_memory_tolerance = 0.10 # relative increase of max rss reported as a regression
+benchmark_accuracy_tolerance = 0.005 # absolute decrease of an accuracy reported as a regression
+benchmark_min_time_change_ms = 5.0 # stage latency changes smaller than this are never regressions (noise of fast stages)
+benchmark_compared_percentiles = (50, 95) # stage percentiles compared with the baseline (p99 of few images is mostly noise)
+
+#stage cache (results of each stage of an image, reused when the same image is processed again)
+stage_cache_enabled = False
+stage_cache_path = "cache/stage_cache.sqlite" # shared by every process using it
+stage_cache_max_bytes = 256 * 1024 * 1024 # total size of the cached results, least recently used evicted above this
+stage_cache_evict_fraction = 0.9 # eviction removes entries until the cache is at this fraction of its max size
+stage_cache_lock_timeout = 30.0 # seconds a process waits for another one writing to the cache
+stage_cache_access_flush = 64 # cache hits whose access times are buffered before writing them (they are also written on each put)
+
+#corners harness (board detection only, against annotated corners)
+corners_harness_workers = None # processes detecting corners, None -> number of cpus
+corners_harness_failure_tolerance = 0.02 # absolute increase of the detection failure rate reported as a regression
@@ -0,0 +1,124 @@
+from pipeline.includes import *
+import pipeline.parameters as Params
+import pipeline.instrumentation as Instr
+import pipeline.stage_cache as StageCache
+import board_recognition.board_recognition as BoardRecogn
+import process_datasets.process_dataset_common as CommonData
+import process_datasets.squares_datasets as ProcSquaresData
+import process_datasets.pieces_datasets as ProcPiecesData
+import models.squares_recognition as ModelsSquares
+import models.pieces_recognition as ModelsPieces
+
+"""
+    Per image stages of the recognition pipeline, shared by the different ways of running it
+"""
+
+def read_board_img(img_path):
+    with Instr.stage("decode"):
+        board_img = cv2.imread(str(img_path), cv2.IMREAD_COLOR)
+
+    if board_img is None:
+        raise Exception('Error opening image:', str(img_path))
+
+    return board_img
+
+# decode image received in memory (ex: uploaded file contents)
+def decode_board_img(img_bytes):
+    with Instr.stage("decode"):
+        board_img = cv2.imdecode(np.frombuffer(img_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    if board_img is None:
+        raise Exception('Error decoding image')
+
+    return board_img
+
+# board dict of an image (file path, or bytes received in memory), with the fields of its last cached stage (see StageCache)
+# the image is only decoded if some stage still has to run
+def load_board(image, img_bytes=None):
+    if not StageCache.is_enabled():
+        board_img = decode_board_img(img_bytes) if img_bytes is not None else read_board_img(image)
+        return {"image": image, "board_img": board_img}
+
+    if img_bytes is None:
+        with Instr.stage("decode"):
+            img_bytes = Path(image).read_bytes()
+
+    board = {"image": image, "image_hash": StageCache.image_hash(img_bytes)}
+    board.update(StageCache.lookup(board["image_hash"]))
+
+    if "piece_predicts" not in board:
+        board["board_img"] = decode_board_img(img_bytes)
+
+    return board
+
+# cpu stages before the occupancy model that the board still needs (corners not cached -> detection, squares crops if
+# occupancy not cached, or only the warp for the pieces crops)
+def process_board_cpu_squares(board):
+    if "piece_predicts" in board:
+        return board
+
+    if "corner_points" not in board:
+        board["corner_points"] = BoardRecogn.process_board(board["board_img"])
+        StageCache.store("corners", board)
+
+    if "square_predicts" in board:
+        board["warped_board"] = warp_board(board["board_img"], board["corner_points"])
+    else:
+        board["warped_board"], board["square_imgs"] = process_corners_squares(board["board_img"], board["corner_points"], views=Params.squares_crop_views)
+
+    return board
+
+# one warp of the board, with margins for both the squares and the pieces crops
+def warp_board(board_img, corner_points):
+    with Instr.stage("warp"):
+        return CommonData.warp_image_shared(board_img, corner_points, ProcSquaresData.homography_inner_length,
+                                            [(ProcSquaresData.homography_top_margin, ProcSquaresData.homography_other_margins),
+                                             (ProcPiecesData.homography_top_margin, ProcPiecesData.homography_other_margins)])
+
+# cpu stages needed before the occupancy model: find board corners, warp board and crop the 64 squares
+# the warped board is reused later to crop the pieces
+def process_board_squares(board_img):
+    corner_points = BoardRecogn.process_board(board_img)
+    warped_board, square_imgs = process_corners_squares(board_img, corner_points)
+    return corner_points, warped_board, square_imgs
+
+# same as process_board_squares, for corners already known (ex: tracked from a previous frame)
+# views: squares crops as views of the warped board, only for predict_boards_squares (see ProcSquaresData.process_squares_img)
+def process_corners_squares(board_img, corner_points, views=False):
+    warped_board = warp_board(board_img, corner_points)
+
+    with Instr.stage("squares_crop"):
+        square_imgs = ProcSquaresData.process_squares_img(board_img, corner_points, warped_board, views)
+
+    return warped_board, square_imgs
+
+# crop pieces of the squares predicted as occupied
+# returns piece imgs and occupation mask
+def process_board_pieces(board_img, corner_points, square_predicts, warped_board):
+    with Instr.stage("pieces_crop"):
+        pieces_result = ProcPiecesData.process_pieces_img(board_img, corner_points, square_predicts, warped_board)
+
+    if pieces_result is None: # process_pieces_img already printed the error
+        raise Exception("Error cropping pieces")
+
+    return pieces_result
+
+# final vector of pieces, with uncertain predictions replaced by the unknown codes
+def merge_predicts(piece_predicts, uncertain_square_predicts, uncertain_piece_predicts):
+    final_predicts = piece_predicts.copy()
+    final_predicts[uncertain_piece_predicts] = Params.unknown_piece_code
+    final_predicts[uncertain_square_predicts] = Params.unknown_occupation_code
+    return final_predicts
+
+# one occupancy prediction for the squares of several boards
+# returns predicts and uncertain predicts, both of shape (n_boards, 64)
+def predict_boards_squares(square_imgs_list):
+    square_predicts, uncertain_square_predicts = ModelsSquares.interpret_empty_spaces(ProcSquaresData.squares_batch(square_imgs_list))
+    return square_predicts.reshape(-1, 64), uncertain_square_predicts.reshape(-1, 64)
+
+# one pieces prediction for the occupied squares of several boards
+# returns predicts and uncertain predicts, both of shape (n_boards, 64)
+def predict_boards_pieces(piece_imgs_list, occupation_masks):
+    piece_imgs_list = [piece_imgs for piece_imgs in piece_imgs_list if len(piece_imgs) > 0]
+    piece_imgs = np.concatenate(piece_imgs_list) if piece_imgs_list else np.empty((0,))
+    return ModelsPieces.interpret_pieces(piece_imgs, np.stack(occupation_masks))
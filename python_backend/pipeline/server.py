@@ -0,0 +1,249 @@
+from pipeline.includes import *
+import pipeline.parameters as Params
+import pipeline.recognition as Recogn
+import pipeline.instrumentation as Instr
+import pipeline.stage_cache as StageCache
+import models.models_common as ModelsCommon
+
+"""
+    Local asyncio http server for the recognition pipeline, used by the mobile app
+    cpu stages of each request run in a thread pool, crops of concurrent requests are joined in shared model predictions
+
+    POST /recognize (body: image file contents) -> json with corners, piece_predicts and uncertain masks
+    GET /health -> {"status": "ok"}
+    GET /metrics -> stages measurements in prometheus text format (if instrumentation is enabled)
+"""
+
+http_reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error"}
+
+# python3 main.py --serve [port]
+def main_server(args):
+    port = int(args[0]) if args else Params.server_port
+    asyncio.run(run_server(Params.server_host, port))
+
+async def run_server(host=Params.server_host, port=Params.server_port, ready_event=None):
+    ModelsCommon.preload_models()
+    Instr.enable_from_params()
+
+    cpu_executor = ThreadPoolExecutor(max_workers=Params.server_workers)
+    inference_executor = ThreadPoolExecutor(max_workers=1) # models already use every core, predictions run one at a time
+
+    state = {
+        "cpu_executor": cpu_executor,
+        "request_ids": itertools.count(),
+        "squares_batcher": new_batcher(predict_squares_batch, inference_executor),
+        "pieces_batcher": new_batcher(predict_pieces_batch, inference_executor)
+    }
+
+    batcher_tasks = [asyncio.create_task(run_batcher(state["squares_batcher"])),
+                     asyncio.create_task(run_batcher(state["pieces_batcher"]))]
+
+    server = await asyncio.start_server(functools.partial(handle_connection, state), host, port)
+    print("Serving on http://%s:%d" % (host, port))
+
+    if ready_event is not None:
+        ready_event.set()
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        for task in batcher_tasks:
+            task.cancel()
+        cpu_executor.shutdown(wait=False)
+        inference_executor.shutdown(wait=False)
+
+#http
+
+async def handle_connection(state, reader, writer):
+    try:
+        status, response = await handle_request(state, reader)
+    except Exception as e:
+        traceback.print_exc()
+        status, response = 500, {"error": str(e)}
+
+    try:
+        if isinstance(response, str):
+            content_type, body = "text/plain; version=0.0.4", response.encode()
+        else:
+            content_type, body = "application/json", json.dumps(response).encode()
+
+        writer.write(("HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n"
+                      % (status, http_reasons[status], content_type, len(body))).encode() + body)
+        await writer.drain()
+    finally:
+        writer.close()
+
+# returns http status and response (json object, or text)
+async def handle_request(state, reader):
+    request_line = (await reader.readline()).decode('latin-1').split()
+    if len(request_line) != 3:
+        return 400, {"error": "Malformed request line"}
+
+    method, path, _ = request_line
+
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1')
+        if line in ('\r\n', '\n', ''):
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if method == "GET" and path == "/health":
+        return 200, {"status": "ok"}
+
+    if method == "GET" and path == "/metrics":
+        if not Instr.is_enabled():
+            return 404, {"error": "Instrumentation is disabled"}
+        return 200, Instr.export_prometheus()
+
+    if method != "POST" or path != "/recognize":
+        return 404, {"error": "Unknown route: %s %s" % (method, path)}
+
+    content_length = headers.get('content-length', '0')
+    if not (content_length.isascii() and content_length.isdigit()): # só dígitos: int() aceitaria "-5", "+5", "1_000"
+        return 400, {"error": "Invalid Content-Length: %r" % content_length}
+    content_length = int(content_length)
+    if content_length == 0:
+        return 400, {"error": "Missing image in request body"}
+    if content_length > Params.server_max_body_size:
+        return 413, {"error": "Image larger than %d bytes" % Params.server_max_body_size}
+
+    img_bytes = await reader.readexactly(content_length)
+
+    try:
+        return 200, await recognize_img_bytes(state, img_bytes)
+    except Exception as e:
+        return 422, {"error": str(e)}
+
+#recognition
+
+async def recognize_img_bytes(state, img_bytes):
+    loop = asyncio.get_running_loop()
+
+    request_id = next(state["request_ids"])
+
+    # stages already in the stage cache (if enabled) are skipped, a repeated image is only a lookup
+    board = await loop.run_in_executor(state["cpu_executor"], process_img_bytes, request_id, img_bytes)
+
+    if "square_predicts" not in board:
+        board["square_predicts"], board["uncertain_square_predicts"] = await batch_predict(state["squares_batcher"], board["square_imgs"])
+        await loop.run_in_executor(state["cpu_executor"], StageCache.store, "squares", board)
+
+    if "piece_predicts" not in board:
+        pieces_result = await loop.run_in_executor(state["cpu_executor"], process_pieces, request_id, board)
+        board["piece_predicts"], board["uncertain_piece_predicts"] = await batch_predict(state["pieces_batcher"], pieces_result)
+        await loop.run_in_executor(state["cpu_executor"], StageCache.store, "pieces", board)
+
+    return {
+        "corners": board["corner_points"].tolist(),
+        "piece_predicts": board["piece_predicts"].tolist(),
+        "uncertain_square_predicts": board["uncertain_square_predicts"].tolist(),
+        "uncertain_piece_predicts": board["uncertain_piece_predicts"].tolist()
+    }
+
+def process_img_bytes(request_id, img_bytes):
+    with Instr.image("request-%d" % request_id):
+        return Recogn.process_board_cpu_squares(Recogn.load_board("request-%d" % request_id, img_bytes))
+
+def process_pieces(request_id, board):
+    with Instr.image("request-%d" % request_id):
+        return Recogn.process_board_pieces(board["board_img"], board["corner_points"], board["square_predicts"], board["warped_board"])
+
+# inputs: list of square_imgs of each board
+def predict_squares_batch(inputs):
+    return list(zip(*Recogn.predict_boards_squares(inputs)))
+
+# inputs: list of (piece_imgs, occupation_mask) of each board
+def predict_pieces_batch(inputs):
+    piece_imgs_list, occupation_masks = zip(*inputs)
+    return list(zip(*Recogn.predict_boards_pieces(piece_imgs_list, occupation_masks)))
+
+#micro-batching
+
+# predict_func receives a list of inputs, one per board, and returns the list of corresponding outputs
+def new_batcher(predict_func, executor, max_batch_boards=Params.server_max_batch_boards, max_wait=Params.server_max_wait):
+    return {"predict_func": predict_func, "executor": executor, "queue": asyncio.Queue(), "max_batch_boards": max_batch_boards, "max_wait": max_wait}
+
+async def batch_predict(batcher, inputs):
+    future = asyncio.get_running_loop().create_future()
+    await batcher["queue"].put((inputs, future))
+    return await future
+
+# wait for a first board, then gather more until max_batch_boards or max_wait, and predict all of them together
+# boards arriving while a prediction is running are gathered for the next one
+async def run_batcher(batcher):
+    loop = asyncio.get_running_loop()
+    queue = batcher["queue"]
+
+    while True:
+        items = [await queue.get()]
+        deadline = loop.time() + batcher["max_wait"]
+
+        while len(items) < batcher["max_batch_boards"]:
+            if not queue.empty():
+                items.append(queue.get_nowait())
+                continue
+
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        try:
+            outputs = await loop.run_in_executor(batcher["executor"], batcher["predict_func"], [inputs for inputs, _ in items])
+            for (_, future), output in zip(items, outputs):
+                if not future.done():
+                    future.set_result(output)
+
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+
+#local testing
+
+# send concurrent requests with the given images to a running server, and report requests/s
+# python3 main.py --serve-bench <concurrency> <image_path> ... 
+def main_load_test(args):
+    if len(args) < 2:
+        raise Exception("main.py --serve-bench <concurrency> <image_path> ...")
+
+    concurrency = int(args[0])
+    images_bytes = [Path(image_path).read_bytes() for image_path in args[1:]]
+    asyncio.run(load_test(images_bytes, concurrency))
+
+async def load_test(images_bytes, concurrency, host=Params.server_host, port=Params.server_port, requests_count=None):
+    requests_count = requests_count or max(len(images_bytes), concurrency) * 4
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send_limited(img_bytes):
+        async with semaphore:
+            return await post_image(img_bytes, host, port)
+
+    start_time = time.time()
+    results = await asyncio.gather(*[send_limited(images_bytes[i % len(images_bytes)]) for i in range(requests_count)])
+    elapsed_time = time.time() - start_time
+
+    failed_count = sum(1 for status, _ in results if status != 200)
+    print("%d requests (%d failed), concurrency %d: %.2f s, %.2f requests/s" % (requests_count, failed_count, concurrency, elapsed_time, requests_count / elapsed_time))
+    return results
+
+# returns http status and json response
+async def post_image(img_bytes, host=Params.server_host, port=Params.server_port):
+    reader, writer = await asyncio.open_connection(host, port)
+
+    writer.write(("POST /recognize HTTP/1.1\r\nHost: %s\r\nContent-Type: application/octet-stream\r\nContent-Length: %d\r\n\r\n"
+                  % (host, len(img_bytes))).encode() + img_bytes)
+    await writer.drain()
+
+    response = await reader.read()
+    writer.close()
+
+    head, _, body = response.partition(b'\r\n\r\n')
+    status = int(head.split()[1])
+    return status, json.loads(body)
@@ -0,0 +1,213 @@
+from pipeline.includes import *
+import pipeline.parameters as Params
+import pipeline.instrumentation as Instr
+import board_recognition.parameters as BoardParams
+import models.parameters as ModelsParams
+import models.inference_backends as Backends
+import process_datasets.parameters as DataParams
+import process_datasets.squares_datasets as ProcSquaresData
+import process_datasets.pieces_datasets as ProcPiecesData
+import atexit
+import hashlib
+import io
+import sqlite3
+
+"""
+    Persistent cache of the results of each pipeline stage, keyed by the contents of the image (hash of the file bytes)
+    stages and the board fields stored by each one (each stage also keeps the fields of the previous ones):
+        corners: corner_points
+        squares: + square_predicts, uncertain_square_predicts
+        pieces: + piece_predicts, uncertain_piece_predicts
+    the key of a stage includes the version of that stage and of the ones before it (parameters and model files they use),
+    so changing ex: only the pieces model invalidates only the pieces stage
+    sqlite database (WAL mode) shared by every thread and process using the same stage_cache_path, least recently used
+    entries evicted when the total size goes over stage_cache_max_bytes
+    access times of cache hits are buffered and written in one transaction (on the next put, every stage_cache_access_flush hits,
+    and at exit), a hit is a single SELECT
+"""
+
+stage_fields = {
+    "corners": ("corner_points",),
+    "squares": ("corner_points", "square_predicts", "uncertain_square_predicts"),
+    "pieces": ("corner_points", "square_predicts", "uncertain_square_predicts", "piece_predicts", "uncertain_piece_predicts")
+}
+stages_order = ("corners", "squares", "pieces")
+
+# parameters read by each stage that change its results (execution settings like batch sizes or compiled predictions left out)
+# the model files (and inference_backend, through the exported file) are fingerprinted by model_fingerprint
+stage_data_params = {
+    "squares": ("crop_engine", "warp_roi_enabled", "warp_roi_padding")
+}
+stage_models_params = {
+    "squares": ("squares_image_size", "square_threshold_predict", "uint8_model_inputs"),
+    "pieces": ("square_threshold_predict", "uint8_model_inputs")
+}
+
+_connections = threading.local() # sqlite connections can't be shared between threads
+_accesses = {} # key -> time of the last hit, not yet written
+_accesses_lock = threading.Lock()
+_versions = {} # stage -> version, computed once per process
+_file_hashes = {} # (path, size, mtime) -> hash of the file contents
+_versions_lock = threading.RLock() # stage_version of a stage calls it for the previous stage
+
+def is_enabled():
+    return Params.stage_cache_enabled
+
+def image_hash(img_bytes):
+    return hashlib.blake2b(img_bytes, digest_size=20).hexdigest()
+
+# fields of the last cached stage of the image (and of the stages before it), empty dict if nothing is cached
+def lookup(img_hash):
+    for stage in reversed(stages_order):
+        values = get(stage, img_hash)
+        if values is not None:
+            return values
+    return {}
+
+# stores the fields of the stage from the board dict (needs "image_hash", set by Recogn.load_board)
+def store(stage, board):
+    if not is_enabled() or "image_hash" not in board:
+        return
+    put(stage, board["image_hash"], {field: board[field] for field in stage_fields[stage]})
+
+def get(stage, img_hash):
+    key = stage_key(stage, img_hash)
+
+    with Instr.stage("stage_cache"):
+        connection = get_connection()
+        row = connection.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        with _accesses_lock:
+            _accesses[key] = time.time()
+            flush = len(_accesses) >= Params.stage_cache_access_flush
+        if flush:
+            with connection:
+                flush_accesses(connection)
+
+    with np.load(io.BytesIO(row[0]), allow_pickle=False) as arrays:
+        return {field: arrays[field] for field in arrays.files}
+
+def put(stage, img_hash, values):
+    buffer = io.BytesIO()
+    np.savez(buffer, **{field: np.asarray(value) for field, value in values.items()})
+    value = buffer.getvalue()
+
+    with Instr.stage("stage_cache"):
+        connection = get_connection()
+        with connection: # transação -> commit, ou rollback se falhar
+            flush_accesses(connection) # antes de evict, para a ordem LRU contar com os hits recentes
+            connection.execute("INSERT OR REPLACE INTO entries (key, stage, value, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                               (stage_key(stage, img_hash), stage, value, len(value), time.time()))
+            evict(connection)
+
+# writes the buffered access times of the hits, inside the caller's transaction
+def flush_accesses(connection):
+    with _accesses_lock:
+        accesses = [(access_time, key) for key, access_time in _accesses.items()]
+        _accesses.clear()
+
+    if accesses:
+        connection.executemany("UPDATE entries SET last_access = ? WHERE key = ?", accesses)
+
+@atexit.register
+def flush_accesses_at_exit():
+    if _accesses:
+        connection = get_connection()
+        with connection:
+            flush_accesses(connection)
+
+# removes least recently used entries until the cache is under stage_cache_evict_fraction of its max size
+def evict(connection):
+    total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+    if total_size <= Params.stage_cache_max_bytes:
+        return
+
+    target_size = Params.stage_cache_max_bytes * Params.stage_cache_evict_fraction
+    evicted_keys = []
+    for key, size in connection.execute("SELECT key, size FROM entries ORDER BY last_access"):
+        if total_size <= target_size:
+            break
+        evicted_keys.append((key,))
+        total_size -= size
+
+    connection.executemany("DELETE FROM entries WHERE key = ?", evicted_keys)
+
+def clear():
+    connection = get_connection()
+    with connection:
+        connection.execute("DELETE FROM entries")
+
+def get_connection():
+    connection = getattr(_connections, "connection", None)
+    if connection is None:
+        cache_path = Path(Params.stage_cache_path)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+
+        connection = sqlite3.connect(str(cache_path), timeout=Params.stage_cache_lock_timeout)
+        connection.execute("PRAGMA journal_mode=WAL") # leitores não bloqueiam escritores de outros processos
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, stage TEXT, value BLOB, size INTEGER, last_access REAL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        connection.commit()
+        _connections.connection = connection
+
+    return connection
+
+#keys
+
+def stage_key(stage, img_hash):
+    return "%s:%s:%s" % (stage, img_hash, stage_version(stage))
+
+# hash of everything a stage result depends on, including the previous stages
+def stage_version(stage):
+    with _versions_lock:
+        if stage not in _versions:
+            if stage == "corners":
+                parts = [module_fingerprint(BoardParams)]
+            elif stage == "squares":
+                parts = [stage_version("corners"), params_fingerprint(DataParams, stage_data_params[stage]), module_fingerprint(ProcSquaresData),
+                         params_fingerprint(ModelsParams, stage_models_params[stage]), model_fingerprint(ModelsParams.best_squares_model_path)]
+            else:
+                parts = [stage_version("squares"), module_fingerprint(ProcPiecesData),
+                         params_fingerprint(ModelsParams, stage_models_params[stage]), model_fingerprint(ModelsParams.best_pieces_model_path)]
+            _versions[stage] = hashlib.blake2b("|".join(parts).encode(), digest_size=8).hexdigest()
+
+        return _versions[stage]
+
+# values of the module constants (numbers, strings, and tuples/lists/dicts of them)
+def module_fingerprint(module):
+    constants = sorted((name, repr(value)) for name, value in vars(module).items()
+                       if not name.startswith('_') and isinstance(value, (int, float, str, bool, tuple, list, dict, type(None))))
+    return hashlib.blake2b(repr(constants).encode(), digest_size=8).hexdigest()
+
+# values of only the given parameters of a module
+def params_fingerprint(module, names):
+    constants = [(name, repr(getattr(module, name))) for name in sorted(names)]
+    return hashlib.blake2b(repr(constants).encode(), digest_size=8).hexdigest()
+
+# hash of the contents of the model file used by the inference backend
+def model_fingerprint(model_path):
+    if ModelsParams.inference_backend != "keras":
+        model_path = Backends.exported_model_path(model_path, ModelsParams.inference_backend)
+
+    model_path = Path(model_path)
+    if not model_path.exists():
+        return "missing:" + str(model_path)
+
+    stat = model_path.stat()
+    file_key = (str(model_path.resolve()), stat.st_size, stat.st_mtime_ns)
+    if file_key not in _file_hashes:
+        file_hash = hashlib.blake2b(digest_size=8)
+        with model_path.open('rb') as model_file:
+            for chunk in iter(lambda: model_file.read(1 << 20), b''):
+                file_hash.update(chunk)
+        _file_hashes[file_key] = file_hash.hexdigest()
+
+    return _file_hashes[file_key]
+
+# versions are computed once per process -> call after changing parameters or models at runtime
+def reset_versions():
+    with _versions_lock:
+        _versions.clear()
@@ -0,0 +1,88 @@
+from pipeline.includes import *
+import pipeline.parameters as Params
+import subprocess
+import statistics
+
+"""
+    Cold start benchmark of the CLI, based on python -X importtime
+    each run imports the target in a fresh interpreter and parses the import times it writes to stderr
+    fails (exit code 1) if the median cumulative import time exceeds the budget or a forbidden heavy module is imported at startup
+"""
+
+backend_dir = Path(__file__).resolve().parent.parent
+
+def main_startup_bench(args):
+    if len(args) > 1:
+        raise Exception("main.py --startup-bench [<output_json_path>]")
+
+    report = startup_benchmark()
+    print_report(report)
+
+    if args:
+        with open(args[0], 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if not report["passed"]:
+        sys.exit(1)
+
+def startup_benchmark(target=Params.startup_bench_target, runs=Params.startup_bench_runs, budget_ms=Params.startup_budget_ms, forbidden_modules=Params.startup_forbidden_modules):
+    runs_imports = []
+    wall_times = []
+
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", target], cwd=backend_dir, capture_output=True, text=True)
+        wall_times.append((time.perf_counter() - start_time) * 1000)
+
+        if result.returncode != 0:
+            raise Exception(f">> Startup target failed: {target}\n{result.stderr[-2000:]}")
+        runs_imports.append(parse_importtime(result.stderr))
+
+    # median of each module over the runs, first run pays the disk cache
+    modules = {}
+    for name in runs_imports[0]:
+        cumulative_times = [imports[name]["cumulative_us"] for imports in runs_imports if name in imports]
+        modules[name] = dict(runs_imports[0][name], cumulative_us=statistics.median(cumulative_times))
+
+    import_ms = sum(module["cumulative_us"] for module in modules.values() if module["level"] == 0) / 1000
+    slowest = sorted((module for module in modules.values() if module["level"] <= 1), key=lambda module: module["cumulative_us"], reverse=True) # target itself and what it imports directly
+    loaded_forbidden = sorted({name.split('.')[0] for name in modules if name.split('.')[0] in forbidden_modules})
+
+    return {
+        "target": target,
+        "runs": runs,
+        "wall_ms": statistics.median(wall_times),
+        "import_ms": import_ms,
+        "budget_ms": budget_ms,
+        "modules_count": len(modules),
+        "slowest_imports": [{"module": module["module"], "cumulative_ms": module["cumulative_us"] / 1000} for module in slowest[:Params.startup_report_top]],
+        "forbidden_loaded": loaded_forbidden,
+        "passed": import_ms <= budget_ms and not loaded_forbidden,
+    }
+
+# lines like "import time:       230 |        512 |   numpy.core" -> {module: {self_us, cumulative_us, level}}
+def parse_importtime(stderr_text):
+    imports = {}
+
+    for line in stderr_text.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:"):].split('|')
+        stripped_name = name.strip()
+        level = (len(name) - len(name.lstrip()) - 1) // 2 # cada nível de import aninhado indenta mais 2 espaços
+
+        imports[stripped_name] = {"module": stripped_name, "self_us": int(self_us), "cumulative_us": int(cumulative_us), "level": level}
+
+    return imports
+
+def print_report(report):
+    print(f"Startup of '{report['target']}' (median of {report['runs']} runs)")
+    print(f"  wall time: {report['wall_ms']:.0f} ms, imports: {report['import_ms']:.0f} ms (budget {report['budget_ms']} ms), {report['modules_count']} modules")
+    print("  slowest imports:")
+    for module in report["slowest_imports"]:
+        print(f"    {module['cumulative_ms']:8.1f} ms  {module['module']}")
+
+    if report["forbidden_loaded"]:
+        print(f"  heavy modules imported at startup: {', '.join(report['forbidden_loaded'])}")
+    print("  PASSED" if report["passed"] else "  FAILED")
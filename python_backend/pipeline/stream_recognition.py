@@ -0,0 +1,232 @@
+from pipeline.includes import *
+import pipeline.parameters as Params
+import pipeline.instrumentation as Instr
+import pipeline.recognition as Recogn
+import pipeline.incremental_recognition as IncrRecogn
+import board_recognition.board_recognition as BoardRecogn
+import models.models_common as ModelsCommon
+
+"""
+    Recognition of a stream of frames of the same board (video file, camera, or folder of sequential photos)
+    board corners are detected once with the full Hough pipeline, and then tracked between frames:
+        sparse optical flow of features inside the board -> frame to frame homography (RANSAC) -> moved corners
+    full detection runs again when tracking confidence drops (features lost, inconsistent motion, board area jump)
+    with stream_incremental, only the squares that changed since their last classification go to the models
+"""
+
+def main_stream(args):
+    if len(args) < 1 or len(args) > 2:
+        raise Exception("main.py --stream <video_path | camera_index | frames_folder> [<output_file_path>]")
+
+    process_stream(read_frames(args[0]), args[1] if len(args) == 2 else None)
+
+# frames of a video file, camera (index) or folder of images (sorted by name)
+def read_frames(source):
+    source_path = Path(source)
+
+    if source_path.is_dir():
+        for img_path in sorted(path for path in source_path.iterdir() if path.suffix.lower() in Params.image_extensions):
+            yield Recogn.read_board_img(img_path)
+        return
+
+    capture = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    if not capture.isOpened():
+        raise Exception('Error opening stream:', source)
+
+    try:
+        while True:
+            success, frame = capture.read()
+            if not success:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+# write one json line per frame to output_file_path (if given), print a line per frame and the final summary
+def process_stream(frames, output_file_path=None):
+    ModelsCommon.preload_models()
+    Instr.enable_from_params()
+
+    output_file = None
+    if output_file_path:
+        output_path = Path(output_file_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_file = output_path.open('w')
+
+    latencies = defaultdict(list) # corners source -> latency of each frame
+
+    try:
+        for record in recognize_stream(frames):
+            if "error" in record:
+                print(f"Frame {record['frame']}: {record['error']}")
+            else:
+                latencies[record["corners_source"]].append(record["latency_ms"])
+                classified_info = f", {record['classified_squares']} squares / {record['classified_pieces']} pieces classified" if "classified_squares" in record else ""
+                print(f"Frame {record['frame']}: {record['corners_source']} corners (confidence {record['tracking_confidence']:.2f}){classified_info}, {record['latency_ms']:.1f} ms")
+
+            if output_file:
+                output_file.write(json.dumps(record) + "\n")
+                output_file.flush()
+    finally:
+        if output_file:
+            output_file.close()
+
+    for corners_source, source_latencies in latencies.items():
+        print("%s frames: %d, mean latency %.1f ms" % (corners_source, len(source_latencies), np.mean(source_latencies)))
+
+    if Instr.is_enabled():
+        Instr.print_summary()
+        if output_file_path:
+            Instr.export_json(Path(output_file_path).with_suffix('.stages.json'))
+
+# generator of one result per frame, the tracker keeps the corners state between frames
+def recognize_stream(frames):
+    tracker = new_tracker()
+    board_state = IncrRecogn.new_board_state()
+
+    for frame_index, frame in enumerate(frames):
+        start_time = time.perf_counter()
+
+        try:
+            with Instr.image(f"frame_{frame_index}"):
+                corner_points = update_corners(tracker, frame)
+                if Params.stream_incremental:
+                    result = IncrRecogn.recognize_incremental(board_state, frame, corner_points)
+                else:
+                    result = recognize_frame(frame, corner_points)
+
+        except Exception as e:
+            traceback.print_exc()
+            reset_tracker(tracker) # next frame starts with a full detection
+            IncrRecogn.reset_board_state(board_state)
+            yield {"frame": frame_index, "error": str(e)}
+            continue
+
+        yield {
+            "frame": frame_index,
+            "corners_source": tracker["source"],
+            "tracking_confidence": tracker["confidence"],
+            "latency_ms": (time.perf_counter() - start_time) * 1000,
+            "corners": corner_points.tolist(),
+            **result
+        }
+
+# warp + crops + models, for corners already known
+def recognize_frame(frame, corner_points):
+    warped_board, square_imgs = Recogn.process_corners_squares(frame, corner_points)
+    square_predicts, uncertain_square_predicts = Recogn.predict_boards_squares([square_imgs])
+
+    piece_imgs, occupation_mask = Recogn.process_board_pieces(frame, corner_points, square_predicts[0], warped_board)
+    piece_predicts, uncertain_piece_predicts = Recogn.predict_boards_pieces([piece_imgs], [occupation_mask])
+
+    return {
+        "piece_predicts": Recogn.merge_predicts(piece_predicts[0], uncertain_square_predicts[0], uncertain_piece_predicts[0]).tolist(),
+        "uncertain_square_predicts": uncertain_square_predicts[0].tolist(),
+        "uncertain_piece_predicts": uncertain_piece_predicts[0].tolist()
+    }
+
+def new_tracker():
+    return {
+        "corner_points": None, # corners of the last frame
+        "prev_gray": None, # last frame in greyscale
+        "features": None, # features of the last frame, inside the board, shape (n, 1, 2)
+        "anchor_features": None, # the same features where they were at the last corners update (corner_points), shape (n, 1, 2)
+        "frames_since_detection": 0,
+        "source": None, # "detected" or "tracked", for the last frame
+        "confidence": 0.0 # fraction of the previous features that agree with the last frame homography (1.0 after a detection)
+    }
+
+def reset_tracker(tracker):
+    tracker.update(new_tracker())
+
+# corners of the frame: tracked from the previous frame if possible, otherwise detected with the full pipeline
+def update_corners(tracker, frame):
+    grey_img = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    corner_points = None
+
+    if tracker["corner_points"] is not None and not detection_due(tracker):
+        with Instr.stage("tracking"):
+            corner_points, tracker["confidence"] = track_corners(tracker, grey_img)
+
+    if corner_points is None:
+        corner_points = BoardRecogn.process_board(frame)
+
+        with Instr.stage("tracking"):
+            tracker["features"] = tracker["anchor_features"] = seed_features(grey_img, corner_points)
+
+        tracker["source"], tracker["confidence"], tracker["frames_since_detection"] = "detected", 1.0, 0
+    else:
+        tracker["source"] = "tracked"
+        tracker["frames_since_detection"] += 1
+
+    tracker["corner_points"], tracker["prev_gray"] = corner_points, grey_img
+    return corner_points
+
+def detection_due(tracker):
+    return Params.stream_redetect_interval > 0 and tracker["frames_since_detection"] + 1 >= Params.stream_redetect_interval
+
+# returns (moved corners, confidence), or (None, confidence) if tracking is not reliable for this frame
+# updates the tracker features with the ones that agree with the frame homography
+# motion and homography are measured from the anchor features (positions at the last corners update), not from the previous
+# frame -> slow drift under stream_static_threshold per frame adds up until the corners are moved
+def track_corners(tracker, grey_img):
+    prev_features = tracker["features"]
+    if prev_features is None or len(prev_features) < Params.stream_min_tracked_features:
+        return None, 0.0
+
+    lk_params = dict(winSize=Params.stream_lk_window, maxLevel=Params.stream_lk_levels)
+    next_features, status, _ = cv2.calcOpticalFlowPyrLK(tracker["prev_gray"], grey_img, prev_features, None, **lk_params)
+    back_features, back_status, _ = cv2.calcOpticalFlowPyrLK(grey_img, tracker["prev_gray"], next_features, None, **lk_params)
+
+    # feature só é válida se voltar ao ponto de partida quando seguida ao contrário
+    fb_errors = np.linalg.norm((prev_features - back_features).reshape(-1, 2), axis=1)
+    valid = (status.ravel() == 1) & (back_status.ravel() == 1) & (fb_errors < Params.stream_max_fb_error)
+
+    if valid.sum() < Params.stream_min_tracked_features:
+        return None, valid.sum() / len(prev_features)
+
+    anchor_valid, next_valid = tracker["anchor_features"][valid], next_features[valid]
+
+    # camera parada desde os últimos cantos -> mantém cantos anteriores, sem ruído da homografia
+    motion = np.median(np.linalg.norm((next_valid - anchor_valid).reshape(-1, 2), axis=1))
+    if motion < Params.stream_static_threshold:
+        tracker["features"], tracker["anchor_features"] = next_valid, anchor_valid
+        return tracker["corner_points"], valid.sum() / len(prev_features)
+
+    homography, inliers = cv2.findHomography(anchor_valid, next_valid, cv2.RANSAC, Params.stream_ransac_threshold)
+    if homography is None:
+        return None, 0.0
+
+    inliers = inliers.ravel().astype(bool)
+    confidence = inliers.sum() / len(prev_features)
+    if confidence < Params.stream_min_inlier_ratio or inliers.sum() < Params.stream_min_tracked_features:
+        return None, confidence
+
+    prev_corners = tracker["corner_points"]
+    corner_points = cv2.perspectiveTransform(prev_corners.reshape(-1, 1, 2).astype(np.float64), homography).reshape(prev_corners.shape).astype(prev_corners.dtype)
+
+    if not consistent_board_area(prev_corners, corner_points):
+        return None, confidence
+
+    tracker["features"] = tracker["anchor_features"] = next_valid[inliers]
+    if len(tracker["features"]) < 2 * Params.stream_min_tracked_features: # features foram-se perdendo (oclusões, saíram da imagem) -> novas features
+        tracker["features"] = tracker["anchor_features"] = seed_features(grey_img, corner_points)
+
+    return corner_points, confidence
+
+# board area (of the convex hull of the corners) can't change too much from one frame to the next
+def consistent_board_area(prev_corners, corner_points):
+    prev_area = cv2.contourArea(cv2.convexHull(prev_corners.astype(np.float32)))
+    area = cv2.contourArea(cv2.convexHull(corner_points.astype(np.float32)))
+    return prev_area > 0 and abs(area - prev_area) / prev_area <= Params.stream_max_area_change
+
+# features to track, inside the board polygon (slightly enlarged to keep the border of the board)
+def seed_features(grey_img, corner_points):
+    hull = cv2.convexHull(corner_points.astype(np.float32)).reshape(-1, 2)
+    center = hull.mean(axis=0)
+    hull = center + (hull - center) * (1 + Params.stream_board_mask_margin)
+
+    mask = np.zeros(grey_img.shape, dtype=np.uint8)
+    cv2.fillConvexPoly(mask, np.round(hull).astype(np.int32), 255)
+
+    return cv2.goodFeaturesToTrack(grey_img, Params.stream_max_features, Params.stream_feature_quality, Params.stream_feature_min_distance, mask=mask)
@@ -1,5 +1,6 @@
 import numpy as np
 from pathlib import Path
-import matplotlib.pyplot as plt
+from pipeline.lazy_imports import lazy_module
+plt = lazy_module("matplotlib.pyplot") # matplotlib só é importado no primeiro uso
 import cv2
 import math
\ No newline at end of file
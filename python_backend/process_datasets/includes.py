@@ -3,14 +3,15 @@ import random
 import numpy as np
 import sys
 from pathlib import Path
-import matplotlib.pyplot as plt
+from pipeline.lazy_imports import lazy_module, lazy_callable # tensorflow/sklearn/matplotlib/tqdm só são importados no primeiro uso
+plt = lazy_module("matplotlib.pyplot")
 import json
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed # concurrent process execution
-from tqdm import tqdm # progress bar
+tqdm = lazy_callable("tqdm", "tqdm") # progress bar
 from bisect import bisect_left, bisect_right # bin sort para encontrar image_ids mais facilmente
-import tensorflow as tf
-from sklearn.preprocessing import minmax_scale
-from sklearn.model_selection import train_test_split
+tf = lazy_module("tensorflow")
+minmax_scale = lazy_callable("sklearn.preprocessing", "minmax_scale")
+train_test_split = lazy_callable("sklearn.model_selection", "train_test_split")
 import shutil # copiar,mover ficheiros
 import re
 import print_funcs.print_funcs as Prints
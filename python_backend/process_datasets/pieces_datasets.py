@@ -1,6 +1,4 @@
 from numpy import sin, square
-import rich
-import board_recognition
 from process_datasets.includes import *
 import models.parameters as ModelParams
 import process_datasets.parameters as Params
@@ -38,87 +36,89 @@ out_width = (1 + max_width_increase) * homography_square_length # output width
 # estimated scale from comparing max y value of displacement vectors between original and final corner points
 # efficient, decent results
 # returns list of piece imgs, mask of corresponding positions for images
-def process_pieces_img(board_img, corner_points, vec_labels):
+# warped_board: (warped_img, pts_dst, H) of a warp shared with other croppers, with margins at least as large as these ones
+def process_pieces_img(board_img, corner_points, vec_labels, warped_board=None):
     try:
-        warped_img, pts_dst, H = CommonData.warp_image(board_img, corner_points, 
+        if warped_board is None:
+            warped_board = CommonData.warp_image(board_img, corner_points, 
                                         inner_length=homography_inner_length, 
                                         top_margin=homography_top_margin, 
-                                        other_margin=homography_other_margins)
+                                        other_margin=homography_other_margins,
+                                        canvas=Params.crop_engine == "warp")
+        warped_img, pts_dst, H = warped_board
         
-        pieces = []
-
-        square_size = homography_square_length # size of each square on the board
+        #scalars to calculate extra margins for each piece crop, always relative to the canvas with this module's margins
         top_left = pts_dst[0] # top left point
-
-        #scalars to calculate extra margins for each piece crop
-        horiz_scalar, vert_scalar =  calculate_image_scalars(board_img, corner_points, warped_img, pts_dst)
+        own_pts_dst = pts_dst - top_left + np.array([homography_other_margins, homography_top_margin], dtype=np.float32)
+        own_warped_shape = (homography_top_margin + homography_inner_length + homography_other_margins, homography_inner_length + 2 * homography_other_margins, 3)
+        horiz_scalar, vert_scalar =  calculate_image_scalars(board_img.shape, corner_points, own_warped_shape, own_pts_dst)
 
         # print("Current image: ", corner_points, vert_scalar, horiz_scalar)
 
-        for y in range(8):
-
-            vert_increase = min_height_increase + (max_base_height_increase - min_height_increase) * (1 - y/7)  # more height for elements further back, since they are generally more distorted
-            vert_diff = max_height_increase - vert_increase
-            vert_increase_final = vert_increase + min(vert_scalar * vert_diff * (1 - (y+1)/8), vert_diff) # more height for elements with more vertical displacement
-            # print(f"vert_scalar: {vert_scalar} vert increase before: {vert_increase} , after: {vert_increase_final}")
-
-            for x in range(8):
-                curr_index = y*8 + x
-
-                if (vec_labels[curr_index] == 0.0): # if square is empty, ignore
-                    continue
-
-                if (x < 4): # more left width for elements further left, since they are generally more distorted
-                    left_increase = min_width_increase + (max_base_width_increase - min_width_increase) * (1 - x/3)
-                    right_increase = 0
-                else: # more right width for elements further right, since they are generally more distorted
-                    left_increase = 0
-                    right_increase = min_width_increase + (max_base_width_increase - min_width_increase) * ((x - 4)/3)
+        boxes, flips = pieces_crop_boxes(horiz_scalar, vert_scalar, top_left)
+        occupied = np.flatnonzero(vec_labels != 0.0) # empty squares are ignored
 
-                if (horiz_scalar < 0): # more left width, reduce right width if any
-                    # horiz_scalar_increase = min(abs(horiz_scalar) * (1 - x/7), max_width_increase - max_base_width_increase) # guarantees that the extra width from the rotation does not surpass the max_width_allowed
-                    width_diff = max_width_increase - left_increase
-                    horiz_scalar_increase = min(abs(horiz_scalar) * width_diff * (1 - (x+1)/8), width_diff) # instead of 1 - x/7, so the extra margin starts taking effect in the first square
-                    left_increase_final = max(left_increase, left_increase + horiz_scalar_increase)
-                    right_increase_final = max(0, right_increase - horiz_scalar_increase)
-                    # print(f"horiz_scalar: {horiz_scalar}increase before: left: {left_increase}, right: {right_increase} , after: left: {left_increase_final}, right: {right_increase_final}")
+        if warped_img is None: # crop engine "remap", no canvas
+            pieces = CommonData.remap_tiles(board_img, H, boxes[occupied], (out_height, out_width), CommonData.warp_canvas_size(pts_dst), flips[occupied])
+            return pieces, vec_labels.astype(bool)
 
-                else:
-                    # horiz_scalar_increase = min(horiz_scalar * (x/7), max_width_increase - max_base_width_increase) # guarantees that the extra width from the rotation does not surpass the max_width_allowed
-                    width_diff = max_width_increase - right_increase
-                    horiz_scalar_increase = min(horiz_scalar * width_diff * ((x+1)/8), width_diff)
-                    left_increase_final = max(0 , left_increase - horiz_scalar_increase)
-                    right_increase_final = max(right_increase, right_increase + horiz_scalar_increase)
-                    # print(f"horiz_scalar: {horiz_scalar} increase before: left: {left_increase}, right: {right_increase} , after: left: {left_increase_final}, right: {right_increase_final}")
+        # crops pasted at the bottom left of blank tiles of fixed size, so output is always equal
+        pieces = np.zeros((len(occupied), out_height, out_width, 3), dtype=warped_img.dtype)
 
-                start_x = int(square_size * (x - left_increase_final) + top_left[0]) # posição inicial deste quadrado, menos uma margem para a esquerda, mais margem de rotação (pode ser negativa esta última)
-                end_x = int(square_size * (x + 1 + right_increase_final) + top_left[0]) # posição final deste quadrado, mais margem de direita
+        for i, (start_x, start_y, end_x, end_y) in enumerate(boxes[occupied].tolist()):
+            tile = warped_img[start_y : end_y, start_x : end_x] # cols, rows
+            height, width, _ = tile.shape
+            if flips[occupied[i]]:
+                cv2.flip(tile, 1, dst=pieces[i, -height:, :width]) # flipped straight into the batch (numpy copy of a [:, ::-1] view is much slower)
+            else:
+                pieces[i, -height:, :width] = tile
 
-                start_y = int(square_size * (y - vert_increase_final) + top_left[1]) # posição inicial deste quadrado, menos uma margem para cima
-                end_y = int(square_size * (y + 1) + top_left[1]) # posição final do quadrado
-
-                tile = warped_img[start_y : end_y, start_x : end_x] # cols, rows
-                
-                if (left_increase_final > right_increase_final): # if more space to the left of the piece, flip it so relevant pieces always upper at utmost left of crops
-                    tile = cv2.flip(tile, 1)
-
-                regular_sized_tile = np.zeros((out_height,out_width,3), dtype=tile.dtype) # blank image of fixed size, to fit other image into, so output is always equal
-
-                height,width,_ = tile.shape
-                regular_sized_tile[-height: ,:width] = tile
-
-                pieces.append(regular_sized_tile)
-
-        return np.array(pieces), vec_labels.astype(bool)
+        return pieces, vec_labels.astype(bool)
     
     except Exception as e:
         traceback.print_exc()
 
+# crop box of the piece of each of the 64 squares, in the warped canvas: (64, 4) [start_x, start_y, end_x, end_y], and (64,) flips
+# flip: more space to the left of the piece -> crop flipped, so relevant pieces are always at the upper left of crops
+def pieces_crop_boxes(horiz_scalar, vert_scalar, top_left):
+    square_size = homography_square_length # size of each square on the board
+    y, x = np.arange(8, dtype=np.float64)[:, None], np.arange(8, dtype=np.float64)[None, :]
+
+    vert_increase = min_height_increase + (max_base_height_increase - min_height_increase) * (1 - y/7)  # more height for elements further back, since they are generally more distorted
+    vert_diff = max_height_increase - vert_increase
+    vert_increase_final = vert_increase + np.minimum(vert_scalar * vert_diff * (1 - (y+1)/8), vert_diff) # more height for elements with more vertical displacement
+
+    # more left width for elements further left, more right width for elements further right, since they are generally more distorted
+    left_increase = np.where(x < 4, min_width_increase + (max_base_width_increase - min_width_increase) * (1 - x/3), 0.0)
+    right_increase = np.where(x < 4, 0.0, min_width_increase + (max_base_width_increase - min_width_increase) * ((x - 4)/3))
+
+    if (horiz_scalar < 0): # more left width, reduce right width if any
+        width_diff = max_width_increase - left_increase
+        horiz_scalar_increase = np.minimum(abs(horiz_scalar) * width_diff * (1 - (x+1)/8), width_diff) # instead of 1 - x/7, so the extra margin starts taking effect in the first square
+        left_increase_final = np.maximum(left_increase, left_increase + horiz_scalar_increase)
+        right_increase_final = np.maximum(0, right_increase - horiz_scalar_increase)
+    else:
+        width_diff = max_width_increase - right_increase
+        horiz_scalar_increase = np.minimum(horiz_scalar * width_diff * ((x+1)/8), width_diff)
+        left_increase_final = np.maximum(0, left_increase - horiz_scalar_increase)
+        right_increase_final = np.maximum(right_increase, right_increase + horiz_scalar_increase)
+
+    left_x, top_y = float(top_left[0]), float(top_left[1])
+    boxes = np.empty((8, 8, 4), dtype=np.int64)
+    boxes[..., 0] = np.trunc(square_size * (x - left_increase_final) + left_x) # posição inicial deste quadrado, menos uma margem para a esquerda, mais margem de rotação (pode ser negativa esta última)
+    boxes[..., 1] = np.trunc(square_size * (y - vert_increase_final) + top_y) # posição inicial deste quadrado, menos uma margem para cima
+    boxes[..., 2] = np.trunc(square_size * (x + 1 + right_increase_final) + left_x) # posição final deste quadrado, mais margem de direita
+    boxes[..., 3] = np.trunc(square_size * (y + 1) + top_y) # posição final do quadrado
+
+    flips = np.broadcast_to(left_increase_final > right_increase_final, (8, 8))
+    return boxes.reshape(64, 4), flips.reshape(64)
+
 #calculate left,right and top margins to add to cropped piece of the image:
-def calculate_image_scalars(orig_img, orig_points, final_img, final_points):
+# orig_shape, final_shape: shapes of the images before and after warping
+def calculate_image_scalars(orig_shape, orig_points, final_shape, final_points):
 
-    orig_height, orig_width, _ = orig_img.shape
-    final_height, final_width, _ = final_img.shape
+    orig_height, orig_width, _ = orig_shape
+    final_height, final_width, _ = final_shape
 
 # vertical margin scalar, calculated from displacement vectors between orig and final corner positioins, 4 vectors are summed um, extracting abs(y) of resulting vector
     width_ratio, height_ratio = (orig_width / final_width) , (orig_height / final_height)
@@ -6,7 +6,8 @@ import process_datasets.parameters as Params
     Common functions related to processing images to build datasets
 """
 
-def warp_image(img, corner_points, inner_length=400, top_margin=150, other_margin=25):
+# canvas=False -> (None, pts_dst, H) without warping, for crops sampled straight from img (remap_tiles)
+def warp_image(img, corner_points, inner_length=400, top_margin=150, other_margin=25, canvas=True):
 
     bottom_row = top_margin + inner_length
     right_col = inner_length + other_margin
@@ -18,11 +19,100 @@ def warp_image(img, corner_points, inner_length=400, top_margin=150, other_margi
     ], dtype=np.float32)
 
     H = cv2.getPerspectiveTransform(corner_points, pts_dst)
+    canvas_size = (right_col + other_margin, bottom_row + other_margin)
 
-    im_out = cv2.warpPerspective(img, H, (right_col + other_margin, bottom_row + other_margin))
+    if not canvas:
+        return None, pts_dst, H
+
+    roi = warp_source_roi(img.shape, H, canvas_size) if Params.warp_roi_enabled else None
+    if roi is None:
+        im_out = cv2.warpPerspective(img, H, canvas_size)
+    else: # only the part of the image that lands on the canvas is read, H still maps full image coordinates
+        x0, y0, x1, y1 = roi
+        translation = np.array([[1, 0, x0], [0, 1, y0], [0, 0, 1]], dtype=np.float64)
+        im_out = cv2.warpPerspective(img[y0:y1, x0:x1], H @ translation, canvas_size)
 
     return im_out, pts_dst, H
 
+# (x0, y0, x1, y1) bounding box of the source pixels sampled by a warp to canvas_size (w, h), clipped to the image
+# = corners of the canvas (board + margins) mapped back to the source, plus a few pixels for the interpolation
+# None if the full image should be used (canvas crosses the horizon of the homography, or is outside the image)
+def warp_source_roi(img_shape, H, canvas_size):
+    img_height, img_width = img_shape[:2]
+    canvas_width, canvas_height = canvas_size
+
+    canvas_corners = np.array([[0, 0, 1], [canvas_width, 0, 1], [0, canvas_height, 1], [canvas_width, canvas_height, 1]], dtype=np.float64)
+    source_corners = canvas_corners @ np.linalg.inv(H).T
+    if np.any(source_corners[:, 2] <= 1e-9): # parte do canvas vem de pontos no infinito
+        return None
+
+    source_corners = source_corners[:, :2] / source_corners[:, 2:]
+    padding = Params.warp_roi_padding
+    x0, y0 = np.floor(source_corners.min(axis=0)).astype(np.int64) - padding
+    x1, y1 = np.ceil(source_corners.max(axis=0)).astype(np.int64) + padding + 1
+
+    x0, y0 = max(int(x0), 0), max(int(y0), 0)
+    x1, y1 = min(int(x1), img_width), min(int(y1), img_height)
+    if x1 <= x0 or y1 <= y0: # canvas fora da imagem
+        return None
+
+    return x0, y0, x1, y1
+
+# single warp shared by several croppers, with a canvas big enough for the largest top and other margins of all of them
+# margins: list of (top_margin, other_margin) of each cropper
+def warp_image_shared(img, corner_points, inner_length, margins):
+    top_margin = max(top_margin for top_margin, _ in margins)
+    other_margin = max(other_margin for _, other_margin in margins)
+    return warp_image(img, corner_points, inner_length=inner_length, top_margin=top_margin, other_margin=other_margin,
+                      canvas=Params.crop_engine == "warp")
+
+# (width, height) of the canvas of warp_image, from its pts_dst
+def warp_canvas_size(pts_dst):
+    other_margin = pts_dst[0][0]
+    return int(pts_dst[3][0] + other_margin), int(pts_dst[3][1] + other_margin)
+
+# crops of the warped canvas sampled straight from the source image, in a single cv2.remap, without warping the canvas
+# boxes: (N, 4) [start_x, start_y, end_x, end_y] in canvas coordinates, clipped to the canvas like slices of it
+# each crop goes to the bottom left of its (tile_height, tile_width) tile, rest of the tile black; flips: (N,) crops mirrored horizontally
+# out: optional (N, tile_height, tile_width, 3) uint8 contiguous buffer the tiles are written to
+def remap_tiles(img, H, boxes, tile_shape, canvas_size, flips=None, out=None):
+    tile_height, tile_width = tile_shape
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    tiles_count = len(boxes)
+
+    if out is None:
+        out = np.empty((tiles_count, tile_height, tile_width, img.shape[2]), dtype=img.dtype)
+    if tiles_count == 0:
+        return out
+
+    start_x, start_y = np.clip(boxes[:, 0], 0, canvas_size[0]), np.clip(boxes[:, 1], 0, canvas_size[1])
+    end_x, end_y = np.clip(boxes[:, 2], start_x, canvas_size[0]), np.clip(boxes[:, 3], start_y, canvas_size[1])
+    widths, heights = np.minimum(end_x - start_x, tile_width), np.minimum(end_y - start_y, tile_height)
+
+    # canvas coordinates of each tile pixel, per column and per row
+    cols, rows = np.arange(tile_width), np.arange(tile_height)
+    canvas_x = start_x[:, None] + cols
+    if flips is not None:
+        canvas_x = np.where(np.asarray(flips, dtype=bool)[:, None], (start_x + widths - 1)[:, None] - cols, canvas_x)
+    canvas_y = start_y[:, None] + rows - (tile_height - heights)[:, None]
+    valid = (cols < widths[:, None])[:, None, :] & (rows >= (tile_height - heights)[:, None])[:, :, None] # (N, h, w)
+
+    # source coordinates = H^-1 * canvas coordinates, converted to the fixed point maps of cv2.remap
+    H_inv = np.linalg.inv(H).astype(np.float32)
+    canvas_x, canvas_y = canvas_x[:, None, :].astype(np.float32), canvas_y[:, :, None].astype(np.float32)
+    scale = 1 / (H_inv[2, 0] * canvas_x + H_inv[2, 1] * canvas_y + H_inv[2, 2])
+    map_x = ((H_inv[0, 0] * canvas_x + H_inv[0, 1] * canvas_y + H_inv[0, 2]) * scale).reshape(tiles_count * tile_height, tile_width)
+    map_y = ((H_inv[1, 0] * canvas_x + H_inv[1, 1] * canvas_y + H_inv[1, 2]) * scale).reshape(tiles_count * tile_height, tile_width)
+    if not valid.all():
+        invalid = ~valid.reshape(map_x.shape)
+        map_x[invalid] = -8 # fora da imagem -> preto
+        map_y[invalid] = -8
+    map_xy, map_fraction = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+    cv2.remap(img, map_xy, map_fraction, cv2.INTER_LINEAR, dst=out.reshape(tiles_count * tile_height, tile_width, -1),
+              borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    return out
+
 #  ordenar cantos e labels de tabuleiro, para ficar posicionado corretamente com peças na vertical
 def reorder_chessboard(corners, piece_labels):
     ordered_corners, top_left_idx = sort_corners2(corners)
@@ -14,30 +14,62 @@ homography_top_margin = homography_square_length * 3 # tamanho excessivamente gr
 homography_other_margins = int(homography_square_length / 2)
 
 #corner_points = [top_left, top_right, bottom_left, bottom_right]
-def process_squares_img(board_img, corner_points):
+# warped_board: (warped_img, pts_dst, H) of a warp shared with other croppers, with margins at least as large as these ones
+# views: return the (8, 8, h, w, 3) read only strided view of the warped board instead of a (64, h, w, 3) copy (see squares_batch)
+def process_squares_img(board_img, corner_points, warped_board=None, views=False):
 
-    warped_img, pts_dst, H = CommonData.warp_image(board_img, corner_points, 
+    if warped_board is None:
+        warped_board = CommonData.warp_image(board_img, corner_points, 
                                      inner_length=homography_inner_length, 
                                      top_margin=homography_top_margin, 
-                                     other_margin=homography_other_margins)
+                                     other_margin=homography_other_margins,
+                                     canvas=Params.crop_engine == "warp")
+    warped_img, pts_dst, H = warped_board
     
     #obtain squares images
-    squares = []
     jump_size = homography_square_length
     margin = homography_other_margins
     top_left = pts_dst[0]
 
-    for y in range(8):
-        for x in range(8):
-            start_x = int(x * jump_size)
-            end_x = int(start_x + jump_size*2)
-            start_y = int(top_left[1] - margin + y * jump_size)
-            end_y = int(start_y + jump_size*2)
-
-            tiles = warped_img[start_y : end_y, start_x : end_x] # cols, rows
-            squares.append(tiles)
-
-    return np.array(squares)
+    if warped_img is None: # crop engine "remap", no canvas
+        boxes = []
+        for y in range(8):
+            for x in range(8):
+                start_x = int(top_left[0] - margin + x * jump_size)
+                start_y = int(top_left[1] - margin + y * jump_size)
+                boxes.append((start_x, start_y, start_x + jump_size*2, start_y + jump_size*2))
+
+        return CommonData.remap_tiles(board_img, H, boxes, (jump_size*2, jump_size*2), CommonData.warp_canvas_size(pts_dst))
+
+    windows = square_crop_windows(warped_img, int(top_left[0] - margin), int(top_left[1] - margin), jump_size)
+    if views:
+        return windows
+
+    return windows.reshape(64, jump_size*2, jump_size*2, -1) # single copy of the 64 crops
+
+# crops of 2x2 squares (the square and half a square around it) are on a regular grid of the warped board:
+# (8, 8, 2*jump_size, 2*jump_size, channels) view of them, without copying, row y and col x of the board at [y, x]
+def square_crop_windows(warped_img, start_x, start_y, jump_size):
+    crop_size = jump_size * 2
+    if start_x < 0 or start_y < 0 or start_x + 7 * jump_size + crop_size > warped_img.shape[1] or start_y + 7 * jump_size + crop_size > warped_img.shape[0]:
+        raise Exception("Squares crops outside the warped board")
+
+    row_stride, col_stride, channel_stride = warped_img.strides
+    origin = warped_img[start_y:, start_x:]
+    return np.lib.stride_tricks.as_strided(origin, shape=(8, 8, crop_size, crop_size, warped_img.shape[2]),
+                                           strides=(jump_size * row_stride, jump_size * col_stride, row_stride, col_stride, channel_stride),
+                                           writeable=False)
+
+# squares crops of several boards joined in one (n_boards * 64, h, w, 3) batch, each board copied once into its place
+# square_imgs_list: process_squares_img results of each board, (64, h, w, 3) arrays or (8, 8, h, w, 3) views
+def squares_batch(square_imgs_list):
+    crop_shape = square_imgs_list[0].shape[-3:]
+    batch = np.empty((len(square_imgs_list) * 64,) + crop_shape, dtype=square_imgs_list[0].dtype)
+
+    for i, square_imgs in enumerate(square_imgs_list):
+        batch[i*64 : (i+1)*64].reshape(square_imgs.shape)[...] = square_imgs
+
+    return batch
 
 #obtain dataset of split and separated images of squares in OSF dataset as: occupied,empty
 def process_OSF_dataset_squares(input_folder_path, output_folder_path):